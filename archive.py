@@ -0,0 +1,265 @@
+"""Export and import of snapshot history as a single archive file.
+
+An archive holds selected session stores together with every blob their
+snapshots reference, so history can be backed up or moved as one sequential
+write rather than as millions of small files:
+
+    header     ARCHIVE_MAGIC
+    objects    blobs, chunks, manifests and session stores, back to back
+    index      JSON: {kind: {key: [offset, length]}} plus each session's stamp
+               and the id of the node the sessions came from
+    trailer    TRAILER_MAGIC and the index offset (big-endian u64)
+
+The index comes last so the archive can be written in one pass, and reading
+it first gives random access to any object.  `Archive` presents an archive as
+a sync source node, so importing is `sync.pull` from it: every object is
+verified on arrival and sessions already held are left alone.
+
+Exporting a range of snapshots (see `diff.locate` for how points are given)
+prunes the snapshots outside it from the exported session stores; the
+archive then holds the changes recorded in that range, not the full tree.
+A pruned store is named after its session and the first and last snapshots
+it keeps (`<session>~<uuid>-<uuid>`), so importing ranges of one session side
+by side adds to its history rather than replacing it.
+"""
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import struct
+import tempfile
+from pathlib import Path
+
+from history import ONTOLOGY_IRI, RDF_TYPE, History, read_session
+from sync import BATCH_SIZE, BoundedReader, LocalNode, pull
+
+ARCHIVE_MAGIC = b"versions-archive 1\n"
+TRAILER_MAGIC = b"VRSNIDX1"
+TRAILER = struct.Struct(">8sQ")
+BUFFER_SIZE = 1024 * 1024
+
+
+class Writer:
+    """Appends objects to an archive file and records where each one lands."""
+
+    def __init__(self, f):
+        self.f = f
+        self.index = {'session': {}, 'blob': {}, 'chunk': {}, 'manifest': {}, 'stamps': {}}
+        f.write(ARCHIVE_MAGIC)
+        self.offset = len(ARCHIVE_MAGIC)
+
+    def add(self, kind, key, source):
+        """Copy the open binary file `source` into the archive; returns the sha256 of what was written."""
+        h = hashlib.sha256()
+        start = self.offset
+        while True:
+            block = source.read(BUFFER_SIZE)
+            if not block:
+                break
+            h.update(block)
+            self.f.write(block)
+            self.offset += len(block)
+        self.index[kind][key] = [start, self.offset - start]
+        return h.hexdigest()
+
+    def close(self):
+        self.f.write(json.dumps(self.index, separators=(',', ':')).encode('utf8'))
+        self.f.write(TRAILER.pack(TRAILER_MAGIC, self.offset))
+
+
+def select(history, since=None, until=None):
+    """{session name: set of snapshot uuids} for the snapshots after `since` up to and including `until`."""
+    snapshots = history.all()
+    first = history.locate(since) + 1 if since is not None else 0
+    last = history.locate(until) if until is not None else len(snapshots) - 1
+    selected = {}
+    for snap in snapshots[first:last + 1]:
+        selected.setdefault(snap['session'], set()).add(snap['uuid'])
+    return selected
+
+
+def prune(sqlite_file, keep):
+    """Delete every snapshot not in `keep` (a set of uuids), and its files, from a session store."""
+    conn = sqlite3.connect(str(sqlite_file))
+    try:
+        storids = {iri: storid for storid, iri in conn.execute("SELECT storid, iri FROM resources")}
+        rdf_type = storids.get(RDF_TYPE)
+        snapshot_class = storids.get(ONTOLOGY_IRI + "#Snapshot")
+        files_prop = storids.get(ONTOLOGY_IRI + "#files")
+        uuid_prop = storids.get(ONTOLOGY_IRI + "#uuid4")
+        if rdf_type is None or snapshot_class is None:
+            return
+        iris = {storid: iri for iri, storid in storids.items()}
+        uuids = dict(conn.execute("SELECT s, o FROM datas WHERE p = ?", (uuid_prop,)))
+        dropped = [s for (s,) in conn.execute("SELECT s FROM objs WHERE p = ? AND o = ?", (rdf_type, snapshot_class))
+                   if uuids.get(s, iris[s].rsplit('#', 1)[-1]) not in keep]
+        if not dropped:
+            return
+        conn.execute("CREATE TEMP TABLE dropped (storid INTEGER PRIMARY KEY)")
+        conn.executemany("INSERT INTO dropped VALUES (?)", ((s,) for s in dropped))
+        conn.execute("INSERT OR IGNORE INTO dropped"
+                     " SELECT o FROM objs WHERE p = ? AND s IN (SELECT storid FROM dropped)", (files_prop,))
+        conn.execute("DELETE FROM objs WHERE s IN (SELECT storid FROM dropped) OR o IN (SELECT storid FROM dropped)")
+        conn.execute("DELETE FROM datas WHERE s IN (SELECT storid FROM dropped)")
+        conn.execute("DELETE FROM resources WHERE storid IN (SELECT storid FROM dropped)")
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def export(node, out, since=None, until=None, origin=None):
+    """Write the snapshots of LocalNode `node` between `since` and `until`, and their blobs, to archive `out`.
+
+    `origin` exports the sessions `node` replicated from that node instead of
+    its own.  Returns counts of what was written.  Raises KeyError for an
+    unknown point.
+    """
+    if origin is not None:
+        node = LocalNode(watcher=node.origin_dir(origin), snapshots=node.blobs.root)
+    history = History(node.watcher, node.blobs.root)
+    history.refresh()
+    selected = select(history, since, until)
+    held = {}
+    for snap in history.all():
+        held[snap['session']] = held.get(snap['session'], 0) + 1
+    stats = {'sessions': 0, 'snapshots': 0}
+    out = Path(out)
+    tmp = out.with_name(out.name + ".part")
+    try:
+        with open(tmp, 'wb', buffering=BUFFER_SIZE) as f, tempfile.TemporaryDirectory() as scratch:
+            writer = Writer(f)
+            writer.index['origin'] = origin or node.node_id()
+            digests = set()
+            sessions = []
+            for name, keep in sorted(selected.items()):
+                # copied with the backup API so a session the watcher is writing is read consistently
+                copy = Path(scratch) / (name + ".sqlite3")
+                node.copy_session(name, copy)
+                prune(copy, keep)
+                snapshots = read_session(copy)
+                stats['snapshots'] += len(snapshots)
+                digests.update(fl['sha256'] for snap in snapshots for fl in snap['files'] if 'sha256' in fl)
+                if len(keep) < held[name]:
+                    name = "%s~%s-%s" % (name, snapshots[0]['uuid'], snapshots[-1]['uuid'])
+                sessions.append((name, copy))
+
+            chunks = set()
+            for digest in sorted(digests):
+                manifest = node.blobs.manifest_text(digest)
+                if manifest is None:
+                    if not _add_file(writer, 'blob', digest, node.blobs.loose_path(digest)):
+                        stats['missing'] = stats.get('missing', 0) + 1
+                        continue
+                    stats['blobs'] = stats.get('blobs', 0) + 1
+                    continue
+                for algorithm, chunk, _ in node.blobs.chunks(digest):
+                    key = algorithm + '/' + chunk
+                    if key in chunks:
+                        continue
+                    if not _add_file(writer, 'chunk', key, node.blobs.chunk_path(algorithm, chunk)):
+                        stats['missing'] = stats.get('missing', 0) + 1
+                        continue
+                    chunks.add(key)
+                    stats['chunks'] = stats.get('chunks', 0) + 1
+                writer.add('manifest', digest, io.BytesIO(manifest.encode('utf8')))
+
+            for name, copy in sessions:
+                with open(copy, 'rb') as source:
+                    writer.index['stamps'][name] = writer.add('session', name, source)
+                stats['sessions'] += 1
+            writer.close()
+            stats['bytes'] = writer.offset
+        os.replace(tmp, out)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return stats
+
+
+def _add_file(writer, kind, key, path):
+    try:
+        with open(path, 'rb') as source:
+            writer.add(kind, key, source)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+class Archive:
+    """A read-only archive, usable as the source of `sync.pull`."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.f = open(self.path, 'rb')
+        try:
+            size = os.fstat(self.f.fileno()).st_size
+            if size < len(ARCHIVE_MAGIC) + TRAILER.size or self.f.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                raise ValueError("%s is not a versions archive" % self.path)
+            self.f.seek(-TRAILER.size, os.SEEK_END)
+            magic, offset = TRAILER.unpack(self.f.read(TRAILER.size))
+            if magic != TRAILER_MAGIC:
+                raise ValueError("%s is incomplete: it has no index" % self.path)
+            self.f.seek(offset)
+            self.index = json.loads(self.f.read(size - TRAILER.size - offset))
+        except BaseException:
+            self.f.close()
+            raise
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read(self, kind, key):
+        """The bytes of an object, or None if the archive does not hold it."""
+        entry = self.index[kind].get(key)
+        if entry is None:
+            return None
+        offset, length = entry
+        self.f.seek(offset)
+        return self.f.read(length)
+
+    def node_id(self):
+        return self.index['origin']
+
+    def sessions(self):
+        return dict(self.index['stamps'])
+
+    def copy_session(self, name, dest):
+        offset, length = self.index['session'][name]
+        self.f.seek(offset)
+        with open(dest, 'wb') as out:
+            while length:
+                block = self.f.read(min(length, BUFFER_SIZE))
+                if not block:
+                    raise ValueError("%s is truncated" % self.path)
+                out.write(block)
+                length -= len(block)
+
+    def manifests(self, digests):
+        manifests = {}
+        for digest in digests:
+            data = self.read('manifest', digest)
+            manifests[digest] = None if data is None else data.decode('utf8')
+        return manifests
+
+    def objects(self, wanted):
+        # in archive order, so a large import reads the file front to back
+        entries = sorted((self.index[kind][key][0], kind, key) for kind, key in wanted if key in self.index[kind])
+        for offset, kind, key in entries:
+            length = self.index[kind][key][1]
+            self.f.seek(offset)
+            yield kind, key, length, BoundedReader(self.f, length)
+
+
+def import_archive(path, dest, batch_size=BATCH_SIZE):
+    """Add the sessions and blobs in archive `path` to LocalNode `dest`; returns counts as `sync.pull` does."""
+    with Archive(path) as source:
+        # an archive never gains objects, so a session missing some is still worth having
+        return pull(source, dest, batch_size, partial=True)
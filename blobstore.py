@@ -0,0 +1,340 @@
+"""Content store under ~/.snapshots.
+
+A file version is identified by the sha256 of its content.  Small files are
+stored whole as ~/.snapshots/<sha256>.  With chunking enabled, larger files are
+split at content-defined boundaries (a gear rolling hash, as in FastCDC) so an
+edit only changes the chunks around it; chunks are stored once each under
+~/.snapshots/chunks/<algorithm>/<digest> and the file is described by a
+manifest at ~/.snapshots/manifests/<sha256> listing its chunks in order.
+
+The rolling hash runs in Python, so when the previous version of a file is
+known its manifest is used to skip it: unchanged leading and trailing chunks
+are recognised by hashing them in place, and only the edited region in
+between is scanned for boundaries.  The result is the same chunking a full
+scan would produce.
+"""
+import bisect
+import hashlib
+import io
+import os
+import re
+import uuid
+from pathlib import Path
+
+digest_re = re.compile(r'^[0-9a-f]{64}$')
+chunk_digest_re = re.compile(r'^[0-9a-f]+$')
+MANIFEST_HEADER = "versions-manifest 1"
+BLOCK_SIZE = 1024 * 1024
+
+# deterministic so every node cuts identical content at identical boundaries
+GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], 'big') for i in range(256)]
+MASK64 = (1 << 64) - 1
+
+
+def chunk_boundaries(data, chunk_size, start=0):
+    """Yield the end offset of each content-defined chunk of `data` from `start`.
+
+    Chunks are at least chunk_size/4 and at most chunk_size*4 bytes (except the
+    last); in between, a boundary falls where the top bits of the gear hash of
+    the preceding 64 bytes are zero, which happens on average every chunk_size
+    bytes.
+    """
+    min_size = max(1, chunk_size // 4)
+    max_size = chunk_size * 4
+    bits = max(1, chunk_size.bit_length() - 1)
+    mask = ((1 << bits) - 1) << (64 - bits)
+    gear = GEAR
+    n = len(data)
+    while start < n:
+        end = min(start + max_size, n)
+        i = start + min_size
+        if i >= end:
+            yield end
+            return
+        h = 0
+        while i < end:
+            h = ((h << 1) + gear[data[i]]) & MASK64
+            i += 1
+            if not h & mask:
+                break
+        yield i
+        start = i
+
+
+class BlobStore:
+    def __init__(self, root, chunking=False, chunk_hash='blake2b', chunk_size=64 * 1024,
+                 chunk_min_file_size=1024 * 1024):
+        self.root = Path(root)
+        self.chunking = chunking
+        self.chunk_hash = chunk_hash
+        self.chunk_size = chunk_size
+        self.chunk_min_file_size = chunk_min_file_size
+        # bytes of content this store has written, so callers can pace their I/O
+        self.written = 0
+        try:
+            hashlib.new(chunk_hash).hexdigest()
+        except (ValueError, TypeError):
+            raise ValueError("unsupported chunk hash %r" % chunk_hash)
+
+    @classmethod
+    def from_settings(cls, root, settings):
+        return cls(root, **{k: settings[k] for k in ('chunking', 'chunk_hash', 'chunk_size', 'chunk_min_file_size')})
+
+    def valid(self, digest):
+        return bool(digest_re.match(digest))
+
+    def loose_path(self, digest):
+        return self.root / digest
+
+    def manifest_path(self, digest):
+        return self.root / "manifests" / digest
+
+    def chunk_path(self, algorithm, digest):
+        return self.root / "chunks" / algorithm / digest
+
+    def put(self, content, previous=None):
+        """Store `content` and return its sha256 digest, writing only what is not already present.
+
+        `previous` is the digest of an earlier version of the same file, if
+        known; its chunks let an edited file be chunked without rescanning it.
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        if self.manifest_path(digest).is_file() or _complete(self.loose_path(digest), len(content)):
+            return digest
+        if self.chunking and len(content) >= self.chunk_min_file_size:
+            self._put_chunked(digest, content, previous)
+        elif _write_if_missing(self.loose_path(digest), content):
+            self.written += len(content)
+        return digest
+
+    def _chunk(self, content, previous):
+        """Yield (end offset, chunk digest) for each chunk of `content`."""
+        old = []
+        manifest = self._manifest(previous) if previous else None
+        if manifest is not None and manifest[:2] == (self.chunk_hash, self.chunk_size):
+            old = manifest[2]
+        view = memoryview(content)
+        size = len(content)
+
+        def digest_at(start, end):
+            return hashlib.new(self.chunk_hash, view[start:end]).hexdigest()
+
+        # leading chunks unchanged since the previous version; its last chunk was cut by
+        # end of file rather than by content, so it only counts if it also ends this file
+        start, k = 0, 0
+        while k < len(old):
+            d, n = old[k]
+            end = start + n
+            if end > size or (k == len(old) - 1 and end != size) or digest_at(start, end) != d:
+                break
+            yield end, d
+            start, k = end, k + 1
+        if start == size:
+            return
+
+        # trailing chunks unchanged; a scan that cuts where one begins can resume from it
+        resume = {}
+        end, j = size, len(old) - 1
+        while j >= k:
+            d, n = old[j]
+            if end - n < start or digest_at(end - n, end) != d:
+                break
+            end -= n
+            resume[end] = j
+            j -= 1
+
+        for end in chunk_boundaries(content, self.chunk_size, start):
+            yield end, digest_at(start, end)
+            start = end
+            if start in resume:
+                for d, n in old[resume[start]:]:
+                    start += n
+                    yield start, d
+                return
+
+    def _put_chunked(self, digest, content, previous=None):
+        view = memoryview(content)
+        lines = ["%s %s %d" % (MANIFEST_HEADER, self.chunk_hash, self.chunk_size)]
+        directory = self.root / "chunks" / self.chunk_hash
+        directory.mkdir(parents=True, exist_ok=True)
+        start = 0
+        for end, chunk_digest in self._chunk(content, previous):
+            if _write_if_missing(directory / chunk_digest, view[start:end]):
+                self.written += end - start
+            lines.append("%s %d" % (chunk_digest, end - start))
+            start = end
+        manifest = self.manifest_path(digest)
+        manifest.parent.mkdir(exist_ok=True)
+        # chunks are all in place before the manifest appears, so a reader never sees a partial file
+        tmp = manifest.with_name(manifest.name + ".tmp")
+        tmp.write_text("\n".join(lines) + "\n")
+        os.replace(tmp, manifest)
+
+    def exists(self, digest):
+        return self.loose_path(digest).is_file() or self.manifest_path(digest).is_file()
+
+    def manifest_text(self, digest):
+        try:
+            return self.manifest_path(digest).read_text()
+        except FileNotFoundError:
+            return None
+
+    def _manifest(self, digest):
+        text = self.manifest_text(digest)
+        return None if text is None else parse_manifest(text)
+
+    def chunks(self, digest):
+        """[(algorithm, chunk digest, length)] for a chunked blob, or None if it is stored whole."""
+        manifest = self._manifest(digest)
+        if manifest is None:
+            return None
+        algorithm, _, entries = manifest
+        return [(algorithm, d, n) for d, n in entries]
+
+    def object_path(self, kind, key):
+        """Path of a 'blob' (key: sha256) or 'chunk' (key: algorithm/digest), or None if the key is malformed."""
+        if kind == 'blob' and digest_re.match(key):
+            return self.loose_path(key)
+        if kind == 'chunk' and key.count('/') == 1:
+            algorithm, digest = key.split('/')
+            if algorithm in hashlib.algorithms_available and chunk_digest_re.match(digest):
+                return self.chunk_path(algorithm, digest)
+        return None
+
+    def put_object(self, kind, key, f):
+        """Store a blob or chunk received from elsewhere, read from binary file `f` to its end.
+
+        The content is hashed as it is copied, in blocks, to a temporary file
+        beside its final path, which is renamed into place only once it matches
+        its digest; returns the number of bytes read.
+        """
+        path = self.object_path(kind, key)
+        if path is None:
+            raise ValueError("malformed %s key %r" % (kind, key))
+        algorithm, digest = ('sha256', key) if kind == 'blob' else key.split('/')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        h = hashlib.new(algorithm)
+        length = 0
+        tmp = path.with_name("%s.%s.part" % (path.name, uuid.uuid4().hex))
+        try:
+            with open(tmp, 'xb') as out:
+                while True:
+                    block = f.read(BLOCK_SIZE)
+                    if not block:
+                        break
+                    h.update(block)
+                    out.write(block)
+                    length += len(block)
+            if h.hexdigest() != digest:
+                raise ValueError("%s %s does not match its digest" % (kind, key))
+            os.replace(tmp, path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        return length
+
+    def put_manifest(self, digest, text):
+        """Install a manifest received from elsewhere; its chunks must already be stored."""
+        algorithm, _, entries = parse_manifest(text)
+        for d, n in entries:
+            if not _complete(self.chunk_path(algorithm, d), n):
+                raise ValueError("manifest %s refers to missing chunk %s" % (digest, d))
+        manifest = self.manifest_path(digest)
+        manifest.parent.mkdir(exist_ok=True)
+        tmp = manifest.with_name(manifest.name + ".tmp")
+        tmp.write_text(text)
+        os.replace(tmp, manifest)
+
+    def size(self, digest):
+        chunks = self.chunks(digest)
+        if chunks is None:
+            return self.loose_path(digest).stat().st_size
+        return sum(n for _, _, n in chunks)
+
+    def open(self, digest):
+        """A seekable binary file of the blob's content; raises FileNotFoundError if absent."""
+        chunks = self.chunks(digest)
+        if chunks is None:
+            return open(self.loose_path(digest), 'rb')
+        return io.BufferedReader(ChunkedReader([(self.chunk_path(a, d), n) for a, d, n in chunks]))
+
+
+def parse_manifest(text):
+    """(chunk algorithm, chunk size, [(chunk digest, length)]) from a manifest's text."""
+    lines = text.splitlines()
+    header = lines[0].split()
+    entries = [(d, int(n)) for d, n in (line.split() for line in lines[1:] if line.strip())]
+    return header[2], int(header[3]), entries
+
+
+def _complete(path, size):
+    # a size mismatch means an earlier write was interrupted
+    try:
+        return path.stat().st_size == size
+    except FileNotFoundError:
+        return False
+
+
+def _write_if_missing(path, content):
+    """Write `content` to `path` unless it is already there; returns whether it wrote."""
+    if _complete(path, len(content)):
+        return False
+    with open(path, 'wb') as f:
+        f.write(content)
+    return True
+
+
+class ChunkedReader(io.RawIOBase):
+    """Reads a sequence of chunk files as one seekable stream."""
+
+    def __init__(self, chunks):
+        self._paths = [path for path, _ in chunks]
+        self._offsets = [0]
+        for _, length in chunks:
+            self._offsets.append(self._offsets[-1] + length)
+        self._pos = 0
+        self._current = None
+        self._current_index = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._offsets[-1]
+        self._pos = max(0, offset)
+        return self._pos
+
+    def readinto(self, buffer):
+        if self._pos >= self._offsets[-1]:
+            return 0
+        index = bisect.bisect_right(self._offsets, self._pos) - 1
+        if index != self._current_index:
+            self._close_current()
+            self._current = open(self._paths[index], 'rb')
+            self._current_index = index
+        self._current.seek(self._pos - self._offsets[index])
+        want = min(len(buffer), self._offsets[index + 1] - self._pos)
+        n = self._current.readinto(memoryview(buffer)[:want])
+        if not n:
+            raise IOError("chunk %s is shorter than its manifest says" % self._paths[index])
+        self._pos += n
+        return n
+
+    def _close_current(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+            self._current_index = None
+
+    def close(self):
+        self._close_current()
+        super().close()
@@ -0,0 +1,65 @@
+"""Watcher settings.
+
+Read from ~/.config/versions/config.yaml when it exists.  Top-level keys apply
+to every watch root; a `roots` mapping overrides them for a given root path:
+
+    chunking: true
+    roots:
+      /home/user/media:
+        chunk_size: 1048576
+"""
+import os
+from pathlib import Path
+
+DEFAULTS = {
+    # store large files as content-defined chunks instead of one blob each
+    'chunking': False,
+    # hashlib algorithm naming chunks; file identities stay sha256
+    'chunk_hash': 'blake2b',
+    # target average chunk size in bytes; boundaries fall between a quarter and four times this
+    'chunk_size': 64 * 1024,
+    # files smaller than this are always stored whole
+    'chunk_min_file_size': 1024 * 1024,
+    # files recorded between commits when ingesting a watchman update
+    'ingest_batch_size': 1000,
+    # resident memory (MB) above which ingestion shrinks its batches; also caps the
+    # session store's page cache at a quarter of this.  None for no limit
+    'memory_limit_mb': None,
+    # bytes per second the watcher may read from watched files / write to the blob store; None for no limit
+    'read_bytes_per_second': None,
+    'write_bytes_per_second': None,
+    # added to the daemon's niceness at startup
+    'niceness': None,
+    # I/O scheduling class for the daemon on Linux: 'best-effort' or 'idle'
+    'ionice_class': None,
+    # files of at least settle_min_file_size are hashed only once no update has arrived for
+    # settle_seconds, or once they have waited settle_max_seconds; 0 hashes everything immediately
+    'settle_seconds': 0,
+    'settle_min_file_size': 16 * 1024 * 1024,
+    'settle_max_seconds': 600,
+}
+
+
+def config_path():
+    return Path(os.environ.get('VERSIONS_CONFIG', Path.home() / ".config" / "versions" / "config.yaml"))
+
+
+def load(root=None, path=None):
+    """Settings for watch root `root`: defaults, then the file's top level, then its `roots` entry."""
+    settings = dict(DEFAULTS)
+    path = Path(path) if path else config_path()
+    if not path.is_file():
+        return settings
+    import yaml
+    with open(path) as f:
+        data = yaml.safe_load(f) or {}
+    roots = data.pop('roots', None) or {}
+    settings.update(data)
+    if root is not None:
+        for candidate, overrides in roots.items():
+            if os.path.abspath(os.path.expanduser(candidate)) == os.path.abspath(root):
+                settings.update(overrides or {})
+    unknown = set(settings) - set(DEFAULTS)
+    if unknown:
+        raise ValueError("unknown settings in %s: %s" % (path, ", ".join(sorted(unknown))))
+    return settings
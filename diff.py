@@ -0,0 +1,157 @@
+"""Diffs between snapshots and between points in time.
+
+Every watchman update records only the files that changed, so the state of the
+tree at a snapshot is the fold of all updates up to it.  A fresh instance (a
+full crawl) restarts from empty the paths recorded under its watch root, and
+only those: sessions of other roots interleave with it in time order.  Diffs compare recorded digests only; no
+content is read unless a line diff is requested, in which case it is streamed
+from the blob store.
+
+Functions here take `snapshots`, the ordered list produced by
+`history.History.all()`.
+"""
+import difflib
+import io
+from datetime import datetime
+
+from blobstore import BlobStore
+
+
+def timestamp_of(point):
+    """Parse a point in time given as epoch seconds or an ISO 8601 string, or return None."""
+    if isinstance(point, (int, float)):
+        return float(point)
+    try:
+        return float(point)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(point).timestamp()
+    except ValueError:
+        return None
+
+
+def locate(snapshots, point, by_uuid=None):
+    """Index of the snapshot named by `point`: a snapshot uuid or a point in time.
+
+    A time resolves to the last snapshot taken at or before it, or -1 (the empty
+    tree) if it precedes all of them.  Raises KeyError if `point` is neither.
+    """
+    if by_uuid is None:
+        by_uuid = {snap['uuid']: i for i, snap in enumerate(snapshots)}
+    if point in by_uuid:
+        return by_uuid[point]
+    when = timestamp_of(point)
+    if when is None:
+        raise KeyError(point)
+    index, last = -1, None
+    for i, snap in enumerate(snapshots):
+        # stores written before snapshots were timestamped inherit their predecessor's time
+        last = snap['attrs'].get('timestamp', last)
+        if last is not None and last > when:
+            break
+        index = i
+    return index
+
+
+class Tree(dict):
+    """{path: digest}, remembering the watch root each path was recorded under."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.roots = dict(args[0].roots) if args and isinstance(args[0], Tree) else {}
+
+
+def apply(tree, snap):
+    """Fold one snapshot's files into `tree` (a Tree) in place."""
+    root = snap['attrs'].get('root')
+    if snap['attrs'].get('is_fresh_instance'):
+        for name in [name for name, r in tree.roots.items() if r == root]:
+            tree.pop(name, None)
+            del tree.roots[name]
+    for fields in snap['files']:
+        name = fields.get('name')
+        if name is None:
+            continue
+        if fields.get('exists', True) is False:
+            tree.pop(name, None)
+            tree.roots.pop(name, None)
+        elif 'sha256' in fields:
+            tree[name] = fields['sha256']
+            tree.roots[name] = root
+
+
+def tree_at(snapshots, index):
+    """The {path: digest} state of the tree after snapshot `index` (-1 is the empty tree)."""
+    tree = Tree()
+    for snap in snapshots[:index + 1]:
+        apply(tree, snap)
+    return tree
+
+
+def compare(snapshots, a, b):
+    """Digests before and after, restricted to the paths that may have changed between indices a <= b.
+
+    Only paths touched by the snapshots after `a` are compared, so the cost is
+    one fold up to `a` plus the size of the delta, not two full trees.
+    """
+    old = tree_at(snapshots, a)
+    between = snapshots[a + 1:b + 1]
+    if any(snap['attrs'].get('is_fresh_instance') for snap in between):
+        new = Tree(old)
+        for snap in between:
+            apply(new, snap)
+        return old, new
+    new = Tree()
+    touched = set()
+    for snap in between:
+        for fields in snap['files']:
+            if 'name' in fields:
+                touched.add(fields['name'])
+    for name in touched:
+        if name in old:
+            new[name] = old[name]
+            new.roots[name] = old.roots[name]
+    for snap in between:
+        apply(new, snap)
+    return {name: old[name] for name in touched if name in old}, new
+
+
+def diff_trees(old, new):
+    return {
+        'added': sorted(new.keys() - old.keys()),
+        'removed': sorted(old.keys() - new.keys()),
+        'modified': sorted(n for n in old.keys() & new.keys() if old[n] != new[n]),
+    }
+
+
+def diff(snapshots, a, b, by_uuid=None):
+    """Paths added, removed and modified going from point `a` to point `b`."""
+    return diff_trees(*digests(snapshots, a, b, by_uuid))
+
+
+def digests(snapshots, a, b, by_uuid=None):
+    """(old, new) {path: digest} maps for the paths that may differ between points `a` and `b`."""
+    i, j = locate(snapshots, a, by_uuid), locate(snapshots, b, by_uuid)
+    if i <= j:
+        return compare(snapshots, i, j)
+    new, old = compare(snapshots, j, i)
+    return old, new
+
+
+def _blob_lines(snapshots_dir, digest):
+    if digest is None:
+        return []
+    with io.TextIOWrapper(BlobStore(snapshots_dir).open(digest), encoding='utf8', errors='replace') as f:
+        return f.readlines()
+
+
+def line_diff(snapshots_dir, name, old_digest, new_digest, context=3):
+    """Yield a unified diff of `name` between two blob digests (None for absent)."""
+    if old_digest == new_digest:
+        return
+    yield from difflib.unified_diff(
+        _blob_lines(snapshots_dir, old_digest), _blob_lines(snapshots_dir, new_digest),
+        fromfile='a/' + name if old_digest else '/dev/null',
+        tofile='b/' + name if new_digest else '/dev/null',
+        n=context)
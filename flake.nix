@@ -27,6 +27,7 @@
           pywatchman
           flask
           werkzeug
+          pyyaml
         ]);
 
         versions = pkgs.stdenv.mkDerivation {
@@ -43,12 +44,16 @@
             # Copy Python files
             cp *.py $out/share/versions/
             
-            # Create wrapper script
-            cat > $out/bin/versions << EOF
+            # Create wrapper scripts: the watcher daemon, and the command line tool
+            cat > $out/bin/versions-watcher << EOF
             #!${pkgs.bash}/bin/bash
             exec ${pythonEnv}/bin/python $out/share/versions/watcher.py "\$@"
             EOF
-            chmod +x $out/bin/versions
+            cat > $out/bin/versions << EOF
+            #!${pkgs.bash}/bin/bash
+            exec ${pythonEnv}/bin/python $out/share/versions/versions_service.py "\$@"
+            EOF
+            chmod +x $out/bin/versions-watcher $out/bin/versions
           '';
         };
       in
@@ -57,6 +62,11 @@
         
         apps.default = flake-utils.lib.mkApp {
           drv = versions;
+          exePath = "/bin/versions-watcher";
+        };
+
+        apps.cli = flake-utils.lib.mkApp {
+          drv = versions;
         };
         
         devShells.default = pkgs.mkShell {
@@ -134,7 +144,7 @@
                       serviceConfig = {
                         Type = "simple";
                         User = username;
-                        ExecStart = "${self.packages.${pkgs.system}.default}/bin/versions ${watchPath}";
+                        ExecStart = "${self.packages.${pkgs.system}.default}/bin/versions-watcher ${watchPath}";
                         Restart = "always";
                         RestartSec = 10;
                       };
@@ -173,7 +183,7 @@
               serviceConfig = {
                 Label = "com.versions";
                 ProgramArguments = [
-                  "${self.packages.${pkgs.system}.default}/bin/versions"
+                  "${self.packages.${pkgs.system}.default}/bin/versions-watcher"
                   cfg.watchPath
                 ];
                 RunAtLoad = true;
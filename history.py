@@ -0,0 +1,316 @@
+"""Read-only access to the snapshot history recorded by watcher.py.
+
+Each watcher session writes an owlready2 quadstore to ~/.watcher/<uuid>.sqlite3
+and file contents to ~/.snapshots/<sha256>.  This module reads the quadstores
+with plain sqlite3 (opened read-only) so tooling can browse history without
+loading owlready2 or contending with the running watcher.
+"""
+import sqlite3
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+import diff as diff_engine
+
+ONTOLOGY_IRI = "https://github.com/heartpunk/versions/ontology.owl"
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+XSD = "http://www.w3.org/2001/XMLSchema#"
+
+_xsd_int = {'integer', 'int', 'long', 'short', 'byte', 'nonNegativeInteger', 'positiveInteger',
+            'negativeInteger', 'unsignedByte', 'unsignedShort', 'unsignedInt', 'unsignedLong'}
+_xsd_float = {'decimal', 'double', 'float'}
+
+def watcher_dir():
+    return Path.home() / ".watcher"
+
+
+def snapshot_dir():
+    return Path.home() / ".snapshots"
+
+
+def _decode(value, datatype_iri):
+    if datatype_iri is None or not datatype_iri.startswith(XSD):
+        return value
+    kind = datatype_iri[len(XSD):]
+    if kind in _xsd_int:
+        return int(value)
+    if kind in _xsd_float:
+        return float(value)
+    if kind == 'boolean':
+        return value in ('true', '1', 1, True)
+    return value
+
+
+class SessionReader:
+    """Reads one session quadstore incrementally.
+
+    The watcher only ever appends to its store, so each `update` reads just
+    the resources, triples and data rows added since the previous one (by
+    storid and rowid) and rebuilds only the snapshots they touch.  A store
+    that was replaced (a new inode, fewer rows than already read, or different
+    contents in the last rows read) is read again from scratch.
+    """
+
+    def __init__(self, sqlite_file):
+        self.path = Path(sqlite_file)
+        self.reset()
+
+    def reset(self):
+        self.inode = None
+        self.iris = {}
+        self.storids = {}
+        self.data = {}
+        self.snapshot_ids = []
+        self.snapshot_set = set()
+        self.members = {}
+        self.owner = {}
+        self.files = {}
+        self.built = {}
+        self.last_resource = self.last_obj = self.last_data = 0
+        self.signature = (None, None)
+
+    def update(self):
+        """Read whatever was added since the last call; returns whether anything was."""
+        inode = self.path.stat().st_ino
+        conn = sqlite3.connect("file:%s?mode=ro" % self.path, uri=True)
+        try:
+            objs_end = conn.execute("SELECT max(rowid) FROM objs").fetchone()[0] or 0
+            datas_end = conn.execute("SELECT max(rowid) FROM datas").fetchone()[0] or 0
+            if inode != self.inode or objs_end < self.last_obj or datas_end < self.last_data \
+                    or self._signature(conn) != self.signature:
+                self.reset()
+                self.inode = inode
+            if objs_end == self.last_obj and datas_end == self.last_data:
+                return False
+            return self._read(conn, objs_end, datas_end)
+        finally:
+            conn.close()
+
+    def _read(self, conn, objs_end, datas_end):
+        for storid, iri in conn.execute("SELECT storid, iri FROM resources WHERE storid > ?", (self.last_resource,)):
+            self.iris[storid] = iri
+            self.storids[iri] = storid
+            self.last_resource = max(self.last_resource, storid)
+        rdf_type = self.storids.get(RDF_TYPE)
+        snapshot_class = self.storids.get(ONTOLOGY_IRI + "#Snapshot")
+        files_prop = self.storids.get(ONTOLOGY_IRI + "#files")
+
+        dirty, dirty_files = set(), set()
+        added = False
+        for s, p, o in conn.execute("SELECT s, p, o FROM objs WHERE rowid > ? AND rowid <= ? ORDER BY rowid",
+                                    (self.last_obj, objs_end)):
+            if p == rdf_type and o == snapshot_class and s not in self.snapshot_set:
+                self.members.setdefault(s, [])
+                self.snapshot_ids.append(s)
+                self.snapshot_set.add(s)
+                added = True
+                dirty.add(s)
+            elif p == files_prop:
+                self.members.setdefault(s, []).append(o)
+                self.owner[o] = s
+                dirty.add(s)
+        for s, p, o, d in conn.execute("SELECT s, p, o, d FROM datas WHERE rowid > ? AND rowid <= ? ORDER BY rowid",
+                                       (self.last_data, datas_end)):
+            fields = self.data.setdefault(s, {})
+            name = self.iris[p].rsplit('#', 1)[-1]
+            if name not in fields:
+                fields[name] = _decode(o, self.iris.get(d))
+            if s in self.owner:
+                dirty_files.add(s)
+                dirty.add(self.owner[s])
+            else:
+                dirty.add(s)
+        self.last_obj, self.last_data = objs_end, datas_end
+        self.signature = self._signature(conn)
+
+        if added:
+            self.snapshot_ids.sort()
+        for f in dirty_files:
+            self.files.pop(f, None)
+        for s in dirty & self.snapshot_set:
+            self.built[s] = self._build(s)
+        return bool(dirty)
+
+    def _signature(self, conn):
+        # the last rows read; if they differ the store was rewritten, not appended to
+        return (conn.execute("SELECT s, p, o FROM objs WHERE rowid = ?", (self.last_obj,)).fetchone(),
+                conn.execute("SELECT s, p, o FROM datas WHERE rowid = ?", (self.last_data,)).fetchone())
+
+    def _file(self, f):
+        fields = self.files.get(f)
+        if fields is None:
+            fields = dict(self.data.get(f, {}))
+            if 'filename' in fields:
+                fields['name'] = fields.pop('filename')
+            fields.pop('uuid4', None)
+            self.files[f] = fields
+        return fields
+
+    def _build(self, s):
+        attrs = dict(self.data.get(s, {}))
+        return {
+            'uuid': attrs.pop('uuid4', self.iris[s].rsplit('#', 1)[-1]),
+            'session': self.path.stem,
+            'attrs': attrs,
+            'files': [self._file(f) for f in self.members[s]],
+        }
+
+    def snapshots(self):
+        """The snapshots read so far, in creation order."""
+        return [self.built[s] for s in self.snapshot_ids]
+
+
+def read_session(sqlite_file):
+    """Return the snapshots stored in one session quadstore, in creation order.
+
+    Each snapshot is a dict with 'uuid', 'session', 'attrs' (the scalar watchman
+    update fields) and 'files' (a list of dicts of the file's recorded fields,
+    with 'name' restored from 'filename').
+    """
+    reader = SessionReader(sqlite_file)
+    reader.update()
+    return reader.snapshots()
+
+
+def count_snapshots(sqlite_file):
+    """The number of snapshots in a session quadstore, counted without reading them."""
+    conn = sqlite3.connect("file:%s?mode=ro" % sqlite_file, uri=True)
+    try:
+        return conn.execute("SELECT count(*) FROM objs WHERE p = (SELECT storid FROM resources WHERE iri = ?)"
+                            " AND o = (SELECT storid FROM resources WHERE iri = ?)",
+                            (RDF_TYPE, ONTOLOGY_IRI + "#Snapshot")).fetchone()[0]
+    finally:
+        conn.close()
+
+
+class _View:
+    """One refresh's snapshots, in order, with their indexes and memoized queries; never changed once built."""
+
+    def __init__(self, ordered=(), cache_size=1024, generation=0):
+        self.generation = generation
+        self.ordered = list(ordered)
+        self.by_uuid = {snap['uuid']: snap for snap in self.ordered}
+        self.index = {snap['uuid']: i for i, snap in enumerate(self.ordered)}
+        self.file_history = lru_cache(maxsize=cache_size)(self._file_history)
+        self.diff = lru_cache(maxsize=cache_size)(self._diff)
+
+    def _file_history(self, name):
+        versions = []
+        for snap in self.ordered:
+            for fields in snap['files']:
+                if fields.get('name') == name:
+                    versions.append(dict(fields, snapshot=snap['uuid'], session=snap['session']))
+        return versions
+
+    def _diff(self, a, b):
+        return diff_engine.diff(self.ordered, a, b, self.index)
+
+
+class History:
+    """All snapshots under a watcher directory, read incrementally as session files grow.
+
+    The node's own sessions are read by default; `origin` selects instead the
+    sessions replicated from that node (see sync.py).  Snapshots are ordered by
+    the time they were taken, so sessions of different roots interleave.  A
+    snapshot held by more than one store (an imported range of a session that
+    is also held whole) is listed once.
+
+    Each refresh that finds new data builds a new view (the ordered snapshots,
+    their indexes and an LRU cache of query results, so repeated lookups of hot
+    paths never touch SQLite) and swaps it in with one assignment.  A query
+    reads the current view once and works on it throughout, so one running
+    alongside a refresh sees, and caches into, a consistent old view.
+    """
+
+    def __init__(self, watcher=None, snapshots=None, cache_size=1024, origin=None):
+        self.watcher = Path(watcher or watcher_dir())
+        self.snapshots = Path(snapshots or snapshot_dir())
+        self.origin = origin
+        self.sessions_dir = self.watcher / "nodes" / origin if origin else self.watcher
+        self.cache_size = cache_size
+        # refresh runs from request handlers on a threaded server
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._view = _View(cache_size=cache_size)
+
+    def refresh(self):
+        """Read whatever was added to the session stores since the last call; returns whether anything was."""
+        with self._lock:
+            seen = {}
+            for sqlite_file in self.sessions_dir.glob("*.sqlite3"):
+                try:
+                    st = sqlite_file.stat()
+                except FileNotFoundError:
+                    continue
+                seen[sqlite_file] = (st.st_mtime_ns, st.st_size)
+
+            changed = set(seen) != set(self._sessions)
+            for sqlite_file, stamp in seen.items():
+                cached = self._sessions.get(sqlite_file)
+                if cached is not None and cached[0] == stamp:
+                    continue
+                reader = cached[1] if cached is not None else SessionReader(sqlite_file)
+                try:
+                    changed = reader.update() or changed
+                except (sqlite3.DatabaseError, FileNotFoundError):
+                    # the watcher may be mid-write; start this store over at the next refresh
+                    reader.reset()
+                    if cached is None:
+                        continue
+                    changed = True
+                self._sessions[sqlite_file] = (stamp, reader)
+            for sqlite_file in set(self._sessions) - set(seen):
+                del self._sessions[sqlite_file]
+
+            if changed:
+                self._view = _View(self._order(), self.cache_size, self._view.generation + 1)
+            return changed
+
+    def _order(self):
+        keyed = []
+        for sqlite_file, (_, reader) in self._sessions.items():
+            snapshots = reader.snapshots()
+            started = when = self._started(sqlite_file, snapshots)
+            for i, snap in enumerate(snapshots):
+                # stores written before snapshots were timestamped inherit their predecessor's time
+                when = snap['attrs'].get('timestamp', when)
+                keyed.append(((when, started, sqlite_file.name, i), snap))
+        keyed.sort(key=lambda item: item[0])
+        ordered, seen = [], set()
+        for _, snap in keyed:
+            if snap['uuid'] not in seen:
+                seen.add(snap['uuid'])
+                ordered.append(snap)
+        return ordered
+
+    def _started(self, sqlite_file, snapshots):
+        if snapshots and 'timestamp' in snapshots[0]['attrs']:
+            return snapshots[0]['attrs']['timestamp']
+        # stores written before snapshots were timestamped
+        return self._sessions[sqlite_file][0][0] / 1e9
+
+    def all(self):
+        return self._view.ordered
+
+    def get(self, uuid):
+        return self._view.by_uuid.get(uuid)
+
+    def file_history(self, name):
+        """Every recorded version of path `name`, oldest first."""
+        return self._view.file_history(name)
+
+    def locate(self, point):
+        """Index into `all()` of a snapshot uuid or point in time; raises KeyError if unknown."""
+        view = self._view
+        return diff_engine.locate(view.ordered, point, view.index)
+
+    def digests(self, a, b):
+        view = self._view
+        return diff_engine.digests(view.ordered, a, b, view.index)
+
+    def diff(self, a, b):
+        """Paths added, removed and modified going from point `a` to point `b`.
+
+        Points are snapshot uuids or times; only recorded digests are compared.
+        """
+        return self._view.diff(a, b)
@@ -0,0 +1,78 @@
+"""The watcher's map of inodes to the content last hashed for them.
+
+For each (dev, ino) the watcher remembers the name, sha256 and stat fields of
+the last version it hashed, so a file that moved is recognised and its digest
+reused without reading it again, and an edited file can be rechunked against
+its previous version.  A crawl of a large tree visits millions of inodes, so
+the map is kept in SQLite's private temporary database (an unlinked file under
+TMPDIR, gone with the process however it exits) with a small page cache rather
+than in a dict: memory use stays flat however many files are watched.
+"""
+import sqlite3
+
+CACHE_KIB = 2048
+
+
+class InodeIndex:
+    """{(dev, ino): {'name', 'sha256', 'size', 'content.sha1hex', <mtime field>}} on disk."""
+
+    def __init__(self, cache_kib=CACHE_KIB):
+        self.db = sqlite3.connect("")
+        # rebuilt by every watcher process, so nothing here needs to survive a crash
+        self.db.execute("PRAGMA journal_mode = OFF")
+        self.db.execute("PRAGMA cache_size = -%d" % cache_kib)
+        self.db.execute("CREATE TABLE IF NOT EXISTS inodes (dev INTEGER NOT NULL, ino INTEGER NOT NULL, name TEXT,"
+                        " sha256 BLOB, size INTEGER, mtime_field TEXT, mtime, sha1 BLOB, PRIMARY KEY (dev, ino))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS inodes_name ON inodes (name)")
+
+    def close(self):
+        self.db.close()
+
+    def get(self, key):
+        """The entry for `key` (a (dev, ino) pair, or None), or None if it has none."""
+        if key is None:
+            return None
+        row = self.db.execute("SELECT name, sha256, size, mtime_field, mtime, sha1 FROM inodes"
+                              " WHERE dev = ? AND ino = ?", _key(key)).fetchone()
+        return _entry(row)
+
+    def named(self, name):
+        """The entry most recently recorded under path `name`, or None."""
+        row = self.db.execute("SELECT name, sha256, size, mtime_field, mtime, sha1 FROM inodes"
+                              " WHERE name = ? ORDER BY rowid DESC LIMIT 1", (name,)).fetchone()
+        return _entry(row)
+
+    def put(self, key, name, sha256, size=None, mtime_field=None, mtime=None, sha1=None):
+        self.db.execute("INSERT OR REPLACE INTO inodes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        _key(key) + (name, bytes.fromhex(sha256), size, mtime_field, mtime,
+                                     None if sha1 is None else bytes.fromhex(sha1)))
+
+    def forget(self, name):
+        """Drop the entries of inodes last seen at path `name`."""
+        self.db.execute("DELETE FROM inodes WHERE name = ?", (name,))
+
+    def commit(self):
+        self.db.commit()
+
+    def __len__(self):
+        return self.db.execute("SELECT count(*) FROM inodes").fetchone()[0]
+
+
+def _key(key):
+    dev, ino = key
+    # watchman omits dev on some platforms; NULLs would defeat the primary key
+    return (-1 if dev is None else dev, ino)
+
+
+def _entry(row):
+    if row is None:
+        return None
+    name, sha256, size, mtime_field, mtime, sha1 = row
+    entry = {'name': name, 'sha256': sha256.hex()}
+    if size is not None:
+        entry['size'] = size
+    if mtime_field is not None:
+        entry[mtime_field] = mtime
+    if sha1 is not None:
+        entry['content.sha1hex'] = sha1.hex()
+    return entry
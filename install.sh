@@ -39,6 +39,14 @@ echo "Installing dependencies..."
 "$VENV_DIR/bin/pip" install --upgrade pip
 "$VENV_DIR/bin/pip" install -r "$INSTALL_DIR/requirements.txt"
 
+echo "Installing the versions command..."
+mkdir -p /usr/local/bin
+cat > /usr/local/bin/${PROJECT_NAME} << EOF
+#!/bin/bash
+exec $VENV_DIR/bin/python $INSTALL_DIR/versions_service.py "\$@"
+EOF
+chmod +x /usr/local/bin/${PROJECT_NAME}
+
 if [[ "$OS_TYPE" == "linux" ]]; then
     echo "Creating service user..."
     if ! id -u "$SERVICE_USER" >/dev/null 2>&1; then
@@ -0,0 +1,139 @@
+"""Read-only HTTP service over the snapshot history.
+
+    GET /snapshots                  summaries of every snapshot, oldest first
+    GET /snapshots/<uuid>           one snapshot with its files
+    GET /history/<path>             every recorded version of a path
+    GET /diff/<point>/<point>       paths added/removed/modified between two points
+    GET /diff/<point>/<point>/<path>  unified diff of one path between two points
+    GET /blobs/<sha256>             blob content, with Range and conditional request support
+
+and the endpoints another node's `versions sync` pulls from (see sync.py):
+
+    GET  /sync/node                 {"node": id} of this node
+    GET  /sync/sessions             {session: stamp} for every session store of this node's own
+    GET  /sync/sessions/<session>   a consistent copy of one session store
+    POST /sync/manifests            {digest: manifest text or null} for {"digests": [...]}
+    POST /sync/objects              the blobs and chunks named in {"objects": [[kind, key], ...]}
+
+A point is a snapshot uuid, epoch seconds or an ISO 8601 time.  Blobs stored
+whole are streamed straight from ~/.snapshots via `send_file`, which hands the
+open file to the WSGI server's `wsgi.file_wrapper` (sendfile(2) under servers
+that provide it); chunked blobs are reassembled from their chunks as they are
+read.
+"""
+import os
+import tempfile
+import time
+
+from flask import Flask, Response, abort, jsonify, request, send_file
+from werkzeug.wsgi import wrap_file
+
+from blobstore import BlobStore
+from diff import line_diff
+from history import History
+from sync import LocalNode, encode_objects
+
+
+def create_app(history=None, refresh_interval=1.0):
+    app = Flask(__name__)
+    history = history or History()
+    blobs = BlobStore(history.snapshots)
+    local = LocalNode(watcher=history.watcher, snapshots=history.snapshots)
+    last_refresh = [0.0]
+
+    @app.before_request
+    def refresh():
+        # stat the session files at most once per interval rather than per request
+        now = time.monotonic()
+        if now - last_refresh[0] >= refresh_interval:
+            history.refresh()
+            last_refresh[0] = now
+
+    @app.route("/snapshots")
+    def snapshots():
+        return jsonify([
+            {'uuid': snap['uuid'], 'session': snap['session'], 'attrs': snap['attrs'], 'files': len(snap['files'])}
+            for snap in history.all()
+        ])
+
+    @app.route("/snapshots/<uuid>")
+    def snapshot(uuid):
+        snap = history.get(uuid)
+        if snap is None:
+            abort(404)
+        return jsonify(snap)
+
+    @app.route("/history/<path:name>")
+    def file_history(name):
+        versions = history.file_history(name)
+        if not versions:
+            abort(404)
+        return jsonify(versions)
+
+    def check_points(*points):
+        for point in points:
+            try:
+                history.locate(point)
+            except KeyError:
+                abort(404)
+
+    @app.route("/diff/<a>/<b>")
+    def diff(a, b):
+        check_points(a, b)
+        return jsonify(history.diff(a, b))
+
+    @app.route("/diff/<a>/<b>/<path:name>")
+    def file_diff(a, b, name):
+        check_points(a, b)
+        old, new = history.digests(a, b)
+        return Response(line_diff(history.snapshots, name, old.get(name), new.get(name)), mimetype="text/plain")
+
+    @app.route("/blobs/<digest>")
+    def blob(digest):
+        if not blobs.valid(digest):
+            abort(400)
+        if not blobs.exists(digest):
+            abort(404)
+        if blobs.chunks(digest) is None:
+            return send_file(blobs.loose_path(digest), mimetype="application/octet-stream", conditional=True,
+                             etag=digest, max_age=31536000)
+        rv = Response(wrap_file(request.environ, blobs.open(digest)), mimetype="application/octet-stream",
+                      direct_passthrough=True)
+        rv.set_etag(digest)
+        rv.cache_control.max_age = 31536000
+        return rv.make_conditional(request, accept_ranges=True, complete_length=blobs.size(digest))
+
+    @app.route("/sync/node")
+    def sync_node():
+        return jsonify({'node': local.node_id()})
+
+    @app.route("/sync/sessions")
+    def sync_sessions():
+        return jsonify(local.sessions())
+
+    @app.route("/sync/sessions/<name>")
+    def sync_session(name):
+        if name not in local.sessions():
+            abort(404)
+        fd, path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(fd)
+        try:
+            local.copy_session(name, path)
+            f = open(path, 'rb')
+        finally:
+            # the open handle keeps the copy readable until the response is sent
+            os.unlink(path)
+        return send_file(f, mimetype="application/vnd.sqlite3", download_name=name + ".sqlite3")
+
+    @app.route("/sync/manifests", methods=["POST"])
+    def sync_manifests():
+        digests = (request.get_json(silent=True) or {}).get('digests', [])
+        return jsonify(local.manifests([d for d in digests if blobs.valid(d)]))
+
+    @app.route("/sync/objects", methods=["POST"])
+    def sync_objects():
+        wanted = (request.get_json(silent=True) or {}).get('objects', [])
+        wanted = [(kind, key) for kind, key in wanted if blobs.object_path(kind, key) is not None]
+        return Response(encode_objects(local.objects(wanted)), mimetype="application/octet-stream")
+
+    return app
@@ -0,0 +1,308 @@
+"""Replication of snapshot stores between nodes.
+
+A node is a store root holding .watcher (session quadstores) and .snapshots
+(blobs), reached either as a local directory or through another node's
+`versions serve`.  Each node has a random id, kept in .watcher/node-id.
+Sessions received from another node are kept apart from the node's own, under
+.watcher/nodes/<origin id>/, so replicated history is browsed per origin
+(`History(origin=...)`) and never folded into the local timeline.
+
+`pull` brings a destination up to date with a source's own sessions:
+
+1. list the source's sessions and pick those the destination has not yet
+   received in their current state (sessions the destination wrote itself are
+   never overwritten);
+2. copy each such session with SQLite's backup API, so a live session is
+   copied consistently, and collect the file digests its snapshots reference;
+3. reconcile those digests against the destination's blob store and transfer
+   only what is missing, in batches: whole blobs, or for chunked blobs only
+   the chunks the destination lacks, followed by their manifests;
+4. move the session into place and record it as received.  A session is
+   never replaced by a copy holding fewer snapshots than the one held.
+
+Objects are streamed in blocks rather than held whole in memory, hashed as
+they arrive and renamed into place only once they match their digest.  A
+session only becomes visible once its blobs are stored, so an interrupted
+pull leaves a consistent store and rerunning it resumes where it stopped.
+"""
+import json
+import os
+import shutil
+import sqlite3
+import urllib.parse
+import urllib.request
+import uuid
+from pathlib import Path
+
+from blobstore import BLOCK_SIZE, BlobStore, parse_manifest
+from history import count_snapshots, read_session
+
+BATCH_SIZE = 256
+STATE_FILE = "replicated.json"
+NODE_ID_FILE = "node-id"
+
+
+def batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class LocalNode:
+    """A store on the local filesystem, usable as either end of a sync."""
+
+    def __init__(self, root=None, watcher=None, snapshots=None):
+        root = Path(root) if root else Path.home()
+        self.watcher = Path(watcher) if watcher else root / ".watcher"
+        self.blobs = BlobStore(Path(snapshots) if snapshots else root / ".snapshots")
+
+    def node_id(self):
+        """This store's id, created the first time it is asked for."""
+        path = self.watcher / NODE_ID_FILE
+        try:
+            return path.read_text().strip()
+        except FileNotFoundError:
+            pass
+        self.watcher.mkdir(parents=True, exist_ok=True)
+        tmp = self.watcher / (NODE_ID_FILE + ".tmp")
+        tmp.write_text(str(uuid.uuid4()) + "\n")
+        os.replace(tmp, path)
+        return path.read_text().strip()
+
+    def origin_dir(self, origin):
+        """Where sessions from node `origin` are kept: the store's own directory for its own id."""
+        return self.watcher if origin == self.node_id() else self.watcher / "nodes" / origin
+
+    def sessions(self):
+        """{session name: stamp} where the stamp changes whenever the session does."""
+        sessions = {}
+        for path in self.watcher.glob("*.sqlite3"):
+            st = path.stat()
+            sessions[path.stem] = [st.st_size, st.st_mtime_ns]
+        return sessions
+
+    def copy_session(self, name, dest):
+        source = sqlite3.connect("file:%s?mode=ro" % (self.watcher / (name + ".sqlite3")), uri=True)
+        target = sqlite3.connect(str(dest))
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+    def manifests(self, digests):
+        """{digest: manifest text, or None if the blob is stored whole or absent}."""
+        return {d: self.blobs.manifest_text(d) for d in digests}
+
+    def objects(self, wanted):
+        """Yield (kind, key, length, f) for each requested ('blob'|'chunk', key) held here.
+
+        `f` is a binary file to read the object's `length` bytes from, valid
+        until the next item is asked for.
+        """
+        for kind, key in wanted:
+            path = self.blobs.object_path(kind, key)
+            if path is None:
+                continue
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                continue
+            with f:
+                length = os.fstat(f.fileno()).st_size
+                yield kind, key, length, BoundedReader(f, length)
+
+    def replicated(self):
+        try:
+            with open(self.watcher / STATE_FILE) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save_replicated(self, state):
+        tmp = self.watcher / (STATE_FILE + ".tmp")
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.watcher / STATE_FILE)
+
+
+class HttpNode:
+    """A remote node reached through its `versions serve` sync endpoints; source side only."""
+
+    def __init__(self, url, timeout=60):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _open(self, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode('utf8')
+        request = urllib.request.Request(self.url + path, data=data,
+                                         headers={'Content-Type': 'application/json'} if data else {})
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def node_id(self):
+        with self._open("/sync/node") as response:
+            return json.load(response)['node']
+
+    def sessions(self):
+        with self._open("/sync/sessions") as response:
+            return json.load(response)
+
+    def copy_session(self, name, dest):
+        with self._open("/sync/sessions/" + urllib.parse.quote(name)) as response, open(dest, 'wb') as f:
+            shutil.copyfileobj(response, f)
+
+    def manifests(self, digests):
+        with self._open("/sync/manifests", {'digests': list(digests)}) as response:
+            return json.load(response)
+
+    def objects(self, wanted):
+        with self._open("/sync/objects", {'objects': [list(w) for w in wanted]}) as response:
+            while True:
+                header = response.readline()
+                if not header:
+                    return
+                kind, key, length = header.decode('utf8').split()
+                reader = BoundedReader(response, int(length))
+                yield kind, key, reader.length, reader
+                # skip whatever of the object the caller did not read
+                reader.drain()
+
+
+def node(location):
+    """A node for a URL or a local store root."""
+    if location.startswith(("http://", "https://")):
+        return HttpNode(location)
+    return LocalNode(location)
+
+
+class BoundedReader:
+    """Reads the next `length` bytes of binary file `f` and no further; raises ValueError if `f` ends first."""
+
+    def __init__(self, f, length):
+        self.f = f
+        self.length = self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        if not size:
+            return b""
+        data = self.f.read(size)
+        if not data:
+            raise ValueError("stream ended %d bytes short of an object" % self.remaining)
+        self.remaining -= len(data)
+        return data
+
+    def drain(self):
+        while self.read(BLOCK_SIZE):
+            pass
+
+
+def encode_objects(objects):
+    """The stream `HttpNode.objects` reads: a "kind key length" line before each object's bytes."""
+    for kind, key, length, f in objects:
+        yield ("%s %s %d\n" % (kind, key, length)).encode('utf8')
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            yield block
+
+
+def transfer(source, dest, digests, batch_size=BATCH_SIZE, stats=None):
+    """Copy the blobs named by `digests` that `dest` (a BlobStore) lacks from `source`.
+
+    Returns the digests that could not be stored: absent from the source, or
+    chunked with a hash this host does not provide.
+    """
+    stats = stats if stats is not None else {}
+    failed = set()
+    missing = sorted(d for d in digests if not dest.exists(d))
+    for batch in batches(missing, batch_size):
+        manifests = source.manifests(batch)
+        wanted, seen = [], set()
+        for digest in batch:
+            text = manifests.get(digest)
+            if text is None:
+                wanted.append(('blob', digest))
+                continue
+            algorithm, _, entries = parse_manifest(text)
+            for chunk, length in entries:
+                key = algorithm + '/' + chunk
+                path = dest.object_path('chunk', key)
+                if path is None:
+                    failed.add(digest)
+                    break
+                if key not in seen and not path.is_file():
+                    seen.add(key)
+                    wanted.append(('chunk', key))
+
+        for part in batches(wanted, batch_size):
+            for kind, key, length, f in source.objects(part):
+                dest.put_object(kind, key, f)
+                stats[kind + 's'] = stats.get(kind + 's', 0) + 1
+                stats['bytes'] = stats.get('bytes', 0) + length
+
+        for digest in batch:
+            if digest in failed:
+                pass
+            elif manifests.get(digest) is not None:
+                try:
+                    dest.put_manifest(digest, manifests[digest])
+                except ValueError:
+                    failed.add(digest)
+            elif not dest.exists(digest):
+                failed.add(digest)
+    if failed:
+        stats['missing'] = stats.get('missing', 0) + len(failed)
+    return failed
+
+
+def pull(source, dest, batch_size=BATCH_SIZE, partial=False):
+    """Bring LocalNode `dest` up to date with `source`; returns counts of what was transferred.
+
+    A session whose blobs could not all be stored is left out, to be tried
+    again by the next pull, unless `partial` is set (for sources that will
+    never gain the missing objects).
+    """
+    stats = {'sessions': 0}
+    state = dest.replicated()
+    origin = source.node_id()
+    directory = dest.origin_dir(origin)
+    local = {path.stem for path in directory.glob("*.sqlite3")}
+    directory.mkdir(parents=True, exist_ok=True)
+    dest.blobs.root.mkdir(parents=True, exist_ok=True)
+    for name, stamp in sorted(source.sessions().items()):
+        key = origin + "/" + name
+        if name in local and key not in state:
+            # written by the destination's own watcher
+            continue
+        if state.get(key) == stamp:
+            continue
+        part = directory / (name + ".sqlite3.part")
+        held = directory / (name + ".sqlite3")
+        try:
+            source.copy_session(name, part)
+            if held.exists() and count_snapshots(part) < count_snapshots(held):
+                # never trade history already held for a shorter copy of it
+                state[key] = stamp
+                dest.save_replicated(state)
+                stats['skipped'] = stats.get('skipped', 0) + 1
+                continue
+            digests = {f['sha256'] for snap in read_session(part) for f in snap['files'] if 'sha256' in f}
+            if transfer(source, dest.blobs, digests, batch_size, stats) and not partial:
+                # installed only once complete, so the next pull tries the missing blobs again
+                stats['incomplete'] = stats.get('incomplete', 0) + 1
+                continue
+            os.replace(part, held)
+        finally:
+            if part.exists():
+                part.unlink()
+        state[key] = stamp
+        dest.save_replicated(state)
+        stats['sessions'] += 1
+    return stats
+
+
+def exchange(a, b, batch_size=BATCH_SIZE):
+    """Sync two local nodes in both directions."""
+    return pull(a, b, batch_size), pull(b, a, batch_size)
@@ -0,0 +1,96 @@
+"""
+Shared fixtures for building snapshot stores without owlready2.
+
+`write_session` writes a sqlite file laid out like an owlready2 quadstore
+(resources/objs/datas tables) holding the given snapshots, so the read-only
+history tooling can be exercised in isolation from the watcher.
+"""
+import hashlib
+import sqlite3
+
+import pytest
+
+ONTO = "https://github.com/heartpunk/versions/ontology.owl#"
+XSD = "http://www.w3.org/2001/XMLSchema#"
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+
+
+def _xsd(value):
+    if isinstance(value, bool):
+        return XSD + "boolean", "true" if value else "false"
+    if isinstance(value, int):
+        return XSD + "integer", value
+    if isinstance(value, float):
+        return XSD + "double", value
+    return XSD + "string", value
+
+
+def write_session(sqlite_file, snapshots):
+    """Write `snapshots` ({'uuid', 'attrs', 'files'} dicts) as an owlready2-style quadstore.
+
+    Appends to the store if it already exists, as the watcher does.
+    """
+    conn = sqlite3.connect(str(sqlite_file))
+    conn.execute("CREATE TABLE IF NOT EXISTS resources (storid INTEGER PRIMARY KEY, iri TEXT) WITHOUT ROWID")
+    conn.execute("CREATE TABLE IF NOT EXISTS objs (c INTEGER, s INTEGER, p INTEGER, o INTEGER)")
+    conn.execute("CREATE TABLE IF NOT EXISTS datas (c INTEGER, s INTEGER, p INTEGER, o BLOB, d INTEGER)")
+    storids = {iri: storid for storid, iri in conn.execute("SELECT storid, iri FROM resources")}
+
+    def storid(iri):
+        if iri not in storids:
+            storids[iri] = len(storids) + 1
+            conn.execute("INSERT INTO resources VALUES (?, ?)", (storids[iri], iri))
+        return storids[iri]
+
+    def data(subject, key, value):
+        datatype, value = _xsd(value)
+        conn.execute("INSERT INTO datas VALUES (1, ?, ?, ?, ?)",
+                     (subject, storid(ONTO + key), value, storid(datatype)))
+
+    for snap in snapshots:
+        s = storid(ONTO + snap['uuid'])
+        conn.execute("INSERT INTO objs VALUES (1, ?, ?, ?)", (s, storid(RDF_TYPE), storid(ONTO + "Snapshot")))
+        data(s, 'uuid4', snap['uuid'])
+        for key, value in snap.get('attrs', {}).items():
+            data(s, key, value)
+        for i, fields in enumerate(snap['files']):
+            f = storid(ONTO + "%s-file-%d" % (snap['uuid'], i))
+            conn.execute("INSERT INTO objs VALUES (1, ?, ?, ?)", (f, storid(RDF_TYPE), storid(ONTO + "File")))
+            conn.execute("INSERT INTO objs VALUES (1, ?, ?, ?)", (s, storid(ONTO + "files"), f))
+            for key, value in fields.items():
+                data(f, 'filename' if key == 'name' else key, value)
+    conn.commit()
+    conn.close()
+
+
+class Store:
+    """A store root holding .watcher and .snapshots, with helpers to populate it."""
+
+    def __init__(self, root):
+        self.root = root
+        self.watcher = root / ".watcher"
+        self.snapshots = root / ".snapshots"
+        self.watcher.mkdir(parents=True)
+        self.snapshots.mkdir()
+
+    def session(self, name, snapshots):
+        path = self.watcher / (name + ".sqlite3")
+        write_session(path, snapshots)
+        return path
+
+    def blob(self, content):
+        digest = hashlib.sha256(content).hexdigest()
+        (self.snapshots / digest).write_bytes(content)
+        return digest
+
+
+@pytest.fixture
+def store(tmp_path):
+    """A temporary ~/.watcher + ~/.snapshots pair"""
+    return Store(tmp_path)
+
+
+@pytest.fixture
+def make_store(tmp_path):
+    """Factory for several independent stores, e.g. one per replicating node"""
+    return lambda name: Store(tmp_path / name)
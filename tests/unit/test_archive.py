@@ -0,0 +1,157 @@
+"""
+Tests for archive.py, export and import of history as one archive file.
+"""
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from archive import Archive, export, import_archive
+from blobstore import BlobStore
+from history import History
+from sync import LocalNode, pull
+from versions_service import main
+
+
+def snapshot(uuid, timestamp, *files):
+    return {'uuid': uuid, 'attrs': {'timestamp': timestamp},
+            'files': [{'name': name, 'sha256': digest} for name, digest in files]}
+
+
+def uuids(store, origin=None):
+    history = History(store.watcher, store.snapshots, origin=origin)
+    history.refresh()
+    return [s['uuid'] for s in history.all()]
+
+
+class TestExportImport:
+    def test_round_trip(self, make_store, tmp_path):
+        a, b = make_store('a'), make_store('b')
+        x, y = a.blob(b"x contents"), a.blob(b"y contents")
+        a.session('s1', [snapshot('one', 1.0, ('x', x)), snapshot('two', 2.0, ('y', y))])
+
+        stats = export(LocalNode(a.root), tmp_path / 'history.varc')
+        assert stats['sessions'] == 1 and stats['snapshots'] == 2 and stats['blobs'] == 2
+
+        stats = import_archive(tmp_path / 'history.varc', LocalNode(b.root))
+        assert stats['sessions'] == 1 and stats['blobs'] == 2
+        assert uuids(b, LocalNode(a.root).node_id()) == ['one', 'two']
+        assert (b.snapshots / y).read_bytes() == b"y contents"
+
+    def test_second_import_transfers_nothing(self, make_store, tmp_path):
+        a, b = make_store('a'), make_store('b')
+        a.session('s1', [snapshot('one', 1.0, ('x', a.blob(b"x")))])
+        export(LocalNode(a.root), tmp_path / 'h.varc')
+        import_archive(tmp_path / 'h.varc', LocalNode(b.root))
+
+        assert import_archive(tmp_path / 'h.varc', LocalNode(b.root)) == {'sessions': 0}
+
+    def test_range_prunes_snapshots_and_their_blobs(self, make_store, tmp_path):
+        a, b = make_store('a'), make_store('b')
+        old, new = a.blob(b"old"), a.blob(b"new")
+        a.session('s1', [snapshot('one', 1.0, ('x', old)), snapshot('two', 2.0, ('x', new))])
+        a.session('s2', [snapshot('three', 3.0, ('x', old))])
+
+        stats = export(LocalNode(a.root), tmp_path / 'h.varc', since='one', until='two')
+        import_archive(tmp_path / 'h.varc', LocalNode(b.root))
+
+        assert stats['sessions'] == 1 and stats['snapshots'] == 1
+        assert uuids(b, LocalNode(a.root).node_id()) == ['two']
+        assert not (b.snapshots / old).exists()
+        assert (b.snapshots / new).read_bytes() == b"new"
+
+    def test_ranges_of_one_session_add_up(self, make_store, tmp_path):
+        a, b, c = make_store('a'), make_store('b'), make_store('c')
+        x = a.blob(b"x")
+        a.session('s1', [snapshot('one', 1.0, ('x', x)), snapshot('two', 2.0), snapshot('three', 3.0)])
+        export(LocalNode(a.root), tmp_path / 'jan.varc', until='two')
+        export(LocalNode(a.root), tmp_path / 'feb.varc', since='two')
+        export(LocalNode(a.root), tmp_path / 'all.varc')
+
+        import_archive(tmp_path / 'jan.varc', LocalNode(b.root))
+        import_archive(tmp_path / 'feb.varc', LocalNode(b.root))
+        import_archive(tmp_path / 'all.varc', LocalNode(c.root))
+        import_archive(tmp_path / 'jan.varc', LocalNode(c.root))
+
+        origin = LocalNode(a.root).node_id()
+        assert uuids(b, origin) == ['one', 'two', 'three']
+        assert uuids(c, origin) == ['one', 'two', 'three']
+
+    def test_unknown_point(self, store, tmp_path):
+        store.session('s1', [snapshot('one', 1.0)])
+        with pytest.raises(KeyError):
+            export(LocalNode(store.root), tmp_path / 'h.varc', since='nonsense')
+        assert list(tmp_path.glob('*.varc*')) == []
+
+    def test_chunked_blobs_round_trip(self, make_store, tmp_path):
+        a, b = make_store('a'), make_store('b')
+        data = random.Random(1).getrandbits(8 * 100000).to_bytes(100000, 'big')
+        digest = BlobStore(a.snapshots, chunking=True, chunk_size=4096, chunk_min_file_size=1).put(data)
+        a.session('s1', [snapshot('one', 1.0, ('big', digest))])
+
+        stats = export(LocalNode(a.root), tmp_path / 'h.varc')
+        import_archive(tmp_path / 'h.varc', LocalNode(b.root))
+
+        assert stats['chunks'] > 1 and 'blobs' not in stats
+        assert BlobStore(b.snapshots).chunks(digest) is not None
+        with BlobStore(b.snapshots).open(digest) as f:
+            assert f.read() == data
+
+
+class TestArchive:
+    def test_random_access_by_index(self, store, tmp_path):
+        x = store.blob(b"x contents")
+        store.session('s1', [snapshot('one', 1.0, ('x', x))])
+        export(LocalNode(store.root), tmp_path / 'h.varc')
+
+        with Archive(tmp_path / 'h.varc') as archive:
+            assert archive.read('blob', x) == b"x contents"
+            assert archive.read('blob', '0' * 64) is None
+            assert list(archive.sessions()) == ['s1']
+
+    def test_truncated_archive_rejected(self, store, tmp_path):
+        store.session('s1', [snapshot('one', 1.0, ('x', store.blob(b"x")))])
+        export(LocalNode(store.root), tmp_path / 'h.varc')
+        data = (tmp_path / 'h.varc').read_bytes()
+        (tmp_path / 'cut.varc').write_bytes(data[:-20])
+
+        with pytest.raises(ValueError):
+            Archive(tmp_path / 'cut.varc')
+
+    def test_too_short_to_be_an_archive(self, tmp_path):
+        for data in (b"", b"versions"):
+            (tmp_path / 'tiny.varc').write_bytes(data)
+            with pytest.raises(ValueError):
+                Archive(tmp_path / 'tiny.varc')
+
+    def test_export_replicated_sessions(self, make_store, tmp_path):
+        a, b, c = make_store('a'), make_store('b'), make_store('c')
+        a.session('s1', [snapshot('from-a', 1.0, ('x', a.blob(b"x")))])
+        b.session('s2', [snapshot('own', 2.0)])
+        origin = LocalNode(a.root).node_id()
+        pull(LocalNode(a.root), LocalNode(b.root))
+
+        stats = export(LocalNode(b.root), tmp_path / 'a.varc', origin=origin)
+        import_archive(tmp_path / 'a.varc', LocalNode(c.root))
+
+        assert stats['sessions'] == 1 and stats['blobs'] == 1
+        assert uuids(c, origin) == ['from-a']
+
+    def test_cli_rejects_origin_for_import(self, store, tmp_path):
+        with pytest.raises(SystemExit) as exit:
+            main(['--watcher-dir', str(store.watcher), '--origin', 'x', 'import', str(tmp_path / 'h.varc')])
+        assert '--origin' in str(exit.value)
+
+    def test_corrupt_object_rejected_on_import(self, make_store, tmp_path):
+        a, b = make_store('a'), make_store('b')
+        a.session('s1', [snapshot('one', 1.0, ('x', a.blob(b"genuine")))])
+        export(LocalNode(a.root), tmp_path / 'h.varc')
+        data = (tmp_path / 'h.varc').read_bytes().replace(b"genuine", b"tamperd")
+        (tmp_path / 'h.varc').write_bytes(data)
+
+        with pytest.raises(ValueError):
+            import_archive(tmp_path / 'h.varc', LocalNode(b.root))
+        assert list(b.watcher.rglob('*.sqlite3')) == []
@@ -0,0 +1,164 @@
+"""
+Tests for blobstore.py, whole and content-defined chunked blob storage.
+"""
+import hashlib
+import io
+import random
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from blobstore import BlobStore, chunk_boundaries
+
+
+def random_bytes(n, seed=0):
+    return random.Random(seed).getrandbits(8 * n).to_bytes(n, 'big')
+
+
+class TestChunkBoundaries:
+    def test_covers_data_within_size_limits(self):
+        data = random_bytes(200000)
+
+        ends = list(chunk_boundaries(data, 4096))
+        sizes = [b - a for a, b in zip([0] + ends, ends)]
+
+        assert ends[-1] == len(data)
+        assert all(1024 <= n <= 4 * 4096 for n in sizes[:-1])
+
+    def test_boundaries_resynchronise_after_insert(self):
+        data = random_bytes(200000)
+        edited = data[:100000] + b"inserted" + data[100000:]
+
+        before = set(data[a:b] for a, b in zip([0] + list(chunk_boundaries(data, 4096)), chunk_boundaries(data, 4096)))
+        ends = list(chunk_boundaries(edited, 4096))
+        after = [edited[a:b] for a, b in zip([0] + ends, ends)]
+
+        assert sum(chunk not in before for chunk in after) <= 2
+
+    def test_short_data_is_one_chunk(self):
+        assert list(chunk_boundaries(b"abc", 4096)) == [3]
+
+
+class TestBlobStore:
+    def test_small_blob_stored_whole(self, tmp_path):
+        store = BlobStore(tmp_path, chunking=True)
+
+        digest = store.put(b"hello")
+
+        assert digest == hashlib.sha256(b"hello").hexdigest()
+        assert (tmp_path / digest).read_bytes() == b"hello"
+        assert store.chunks(digest) is None
+
+    def test_chunked_roundtrip(self, tmp_path):
+        store = BlobStore(tmp_path, chunking=True, chunk_size=4096, chunk_min_file_size=1)
+        data = random_bytes(100000)
+
+        digest = store.put(data)
+
+        assert not (tmp_path / digest).exists()
+        assert store.size(digest) == len(data)
+        with store.open(digest) as f:
+            assert f.read() == data
+
+    def test_chunked_seek(self, tmp_path):
+        store = BlobStore(tmp_path, chunking=True, chunk_size=4096, chunk_min_file_size=1)
+        data = random_bytes(100000)
+        digest = store.put(data)
+
+        with store.open(digest) as f:
+            f.seek(50000)
+            assert f.read(20000) == data[50000:70000]
+
+    def test_local_edit_stores_only_changed_chunks(self, tmp_path):
+        store = BlobStore(tmp_path, chunking=True, chunk_size=4096, chunk_min_file_size=1)
+        data = random_bytes(200000)
+        store.put(data)
+        chunk_dir = tmp_path / "chunks" / "blake2b"
+        before = set(chunk_dir.iterdir())
+
+        store.put(data[:100000] + b"edit" + data[100004:])
+
+        assert len(set(chunk_dir.iterdir()) - before) <= 2
+
+    def test_previous_version_gives_same_chunks_as_full_scan(self, tmp_path):
+        data = random_bytes(300000)
+        edited = data[:150000] + b"a local edit" + data[150000:]
+        resumed = BlobStore(tmp_path / "resumed", chunking=True, chunk_size=4096, chunk_min_file_size=1)
+        fresh = BlobStore(tmp_path / "fresh", chunking=True, chunk_size=4096, chunk_min_file_size=1)
+
+        previous = resumed.put(data)
+        digest = resumed.put(edited, previous=previous)
+        fresh.put(edited)
+
+        assert resumed.chunks(digest) == fresh.chunks(digest)
+        with resumed.open(digest) as f:
+            assert f.read() == edited
+
+    def test_previous_version_skips_boundary_scan(self, tmp_path):
+        store = BlobStore(tmp_path, chunking=True, chunk_size=4096, chunk_min_file_size=1)
+        data = random_bytes(300000)
+        previous = store.put(data)
+        edited = data[:150000] + b"x" + data[150001:]
+
+        with patch('blobstore.chunk_boundaries', wraps=chunk_boundaries) as scan:
+            digest = store.put(edited, previous=previous)
+
+        start = scan.call_args[0][2]
+        assert 150000 - 4 * 4096 <= start <= 150000
+        with store.open(digest) as f:
+            assert f.read() == edited
+
+    def test_chunk_hash_is_configurable(self, tmp_path):
+        store = BlobStore(tmp_path, chunking=True, chunk_hash='sha1', chunk_size=4096, chunk_min_file_size=1)
+
+        digest = store.put(random_bytes(20000))
+
+        assert {algorithm for algorithm, _, _ in store.chunks(digest)} == {'sha1'}
+        assert (tmp_path / "chunks" / "sha1").is_dir()
+
+    def test_unknown_chunk_hash(self, tmp_path):
+        with pytest.raises(ValueError):
+            BlobStore(tmp_path, chunk_hash='not-a-hash')
+
+    def test_interrupted_write_is_repaired(self, tmp_path):
+        store = BlobStore(tmp_path)
+        digest = hashlib.sha256(b"complete").hexdigest()
+        (tmp_path / digest).write_bytes(b"comp")
+
+        store.put(b"complete")
+
+        assert (tmp_path / digest).read_bytes() == b"complete"
+
+    def test_written_counts_only_new_content(self, tmp_path):
+        store = BlobStore(tmp_path, chunking=True, chunk_size=4096, chunk_min_file_size=1000)
+        data = random_bytes(100000)
+        store.put(b"small")
+        store.put(b"small")
+        assert store.written == 5
+
+        store.put(data)
+        store.put(data[:50000] + b"edit" + data[50004:])
+        assert len(data) < store.written - 5 < 2 * len(data)
+
+    def test_put_object_streams_and_verifies(self, tmp_path):
+        store = BlobStore(tmp_path)
+        data = random_bytes(100000)
+        digest = hashlib.sha256(data).hexdigest()
+
+        with patch('blobstore.BLOCK_SIZE', 4096):
+            assert store.put_object('blob', digest, io.BytesIO(data)) == len(data)
+        assert (tmp_path / digest).read_bytes() == data
+
+        with pytest.raises(ValueError):
+            store.put_object('blob', 'f' * 64, io.BytesIO(data))
+        assert [p.name for p in tmp_path.iterdir()] == [digest]
+
+    def test_valid(self, tmp_path):
+        store = BlobStore(tmp_path)
+
+        assert store.valid('a' * 64)
+        assert not store.valid('../../etc/passwd')
@@ -0,0 +1,40 @@
+"""
+Tests for config.py, watcher settings and per-root overrides.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import config
+
+pytest.importorskip("yaml")
+
+
+class TestConfig:
+    def test_defaults_without_file(self, tmp_path):
+        assert config.load('/watched', tmp_path / 'missing.yaml') == config.DEFAULTS
+
+    def test_root_overrides_top_level(self, tmp_path):
+        path = tmp_path / 'config.yaml'
+        path.write_text(
+            "chunking: true\n"
+            "chunk_size: 1024\n"
+            "roots:\n"
+            "  /watched/media:\n"
+            "    chunk_size: 4096\n")
+
+        media = config.load('/watched/media', path)
+        other = config.load('/watched/code', path)
+
+        assert media['chunking'] is True and media['chunk_size'] == 4096
+        assert other['chunk_size'] == 1024
+
+    def test_unknown_setting(self, tmp_path):
+        path = tmp_path / 'config.yaml'
+        path.write_text("chunk_sise: 1\n")
+
+        with pytest.raises(ValueError):
+            config.load('/watched', path)
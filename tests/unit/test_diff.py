@@ -0,0 +1,120 @@
+"""
+Tests for diff.py, tree states and digest diffs between points in history.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from diff import diff, line_diff, locate, tree_at, timestamp_of
+from versions_service import main
+
+
+def snap(uuid, timestamp, files, fresh=False, root=None):
+    attrs = {'timestamp': timestamp}
+    if fresh:
+        attrs['is_fresh_instance'] = True
+    if root:
+        attrs['root'] = root
+    return {'uuid': uuid, 'session': 's', 'attrs': attrs, 'files': files}
+
+
+@pytest.fixture
+def snapshots():
+    return [
+        snap('a', 100.0, [{'name': 'x', 'sha256': 'x1'}, {'name': 'y', 'sha256': 'y1'}], fresh=True),
+        snap('b', 200.0, [{'name': 'x', 'sha256': 'x2'}]),
+        snap('c', 300.0, [{'name': 'y', 'exists': False}, {'name': 'z', 'sha256': 'z1'}]),
+        snap('d', 400.0, [{'name': 'z', 'sha256': 'z2'}], fresh=True),
+    ]
+
+
+class TestTrees:
+    def test_tree_folds_deltas(self, snapshots):
+        assert tree_at(snapshots, 2) == {'x': 'x2', 'z': 'z1'}
+
+    def test_fresh_instance_resets_tree(self, snapshots):
+        assert tree_at(snapshots, 3) == {'z': 'z2'}
+
+    def test_before_first_snapshot_is_empty(self, snapshots):
+        assert tree_at(snapshots, -1) == {}
+
+    def test_fresh_instance_resets_only_its_root(self):
+        rooted = [
+            snap('a', 100.0, [{'name': 'x', 'sha256': 'x1'}], fresh=True, root='/one'),
+            snap('b', 200.0, [{'name': 'y', 'sha256': 'y1'}], fresh=True, root='/two'),
+            snap('c', 300.0, [{'name': 'z', 'sha256': 'z1'}], fresh=True, root='/two'),
+        ]
+
+        assert tree_at(rooted, 2) == {'x': 'x1', 'z': 'z1'}
+        assert diff(rooted, 'a', 'c') == {'added': ['z'], 'removed': [], 'modified': []}
+
+
+class TestLocate:
+    def test_by_uuid(self, snapshots):
+        assert locate(snapshots, 'c') == 2
+
+    def test_by_time(self, snapshots):
+        assert locate(snapshots, '250') == 1
+        assert locate(snapshots, 300.0) == 2
+        assert locate(snapshots, 50) == -1
+
+    def test_by_iso_time(self, snapshots):
+        assert timestamp_of('1970-01-01T00:03:20+00:00') == 200.0
+        assert locate(snapshots, '1970-01-01T00:03:20+00:00') == 1
+
+    def test_unknown(self, snapshots):
+        with pytest.raises(KeyError):
+            locate(snapshots, 'nope')
+
+
+class TestDiff:
+    def test_between_snapshots(self, snapshots):
+        assert diff(snapshots, 'a', 'c') == {'added': ['z'], 'removed': ['y'], 'modified': ['x']}
+
+    def test_reversed(self, snapshots):
+        assert diff(snapshots, 'c', 'a') == {'added': ['y'], 'removed': ['z'], 'modified': ['x']}
+
+    def test_across_fresh_instance(self, snapshots):
+        assert diff(snapshots, 'b', 'd') == {'added': ['z'], 'removed': ['x', 'y'], 'modified': []}
+
+    def test_between_times(self, snapshots):
+        assert diff(snapshots, 0, 150) == {'added': ['x', 'y'], 'removed': [], 'modified': []}
+
+    def test_same_point(self, snapshots):
+        assert diff(snapshots, 'b', 'b') == {'added': [], 'removed': [], 'modified': []}
+
+
+class TestLineDiff:
+    def test_unified_diff_from_blobs(self, store):
+        old = store.blob(b"one\ntwo\n")
+        new = store.blob(b"one\nthree\n")
+
+        lines = list(line_diff(store.snapshots, 'f.txt', old, new))
+
+        assert lines[0] == '--- a/f.txt\n'
+        assert '-two\n' in lines
+        assert '+three\n' in lines
+
+    def test_added_file(self, store):
+        new = store.blob(b"new\n")
+
+        lines = list(line_diff(store.snapshots, 'f.txt', None, new))
+
+        assert lines[0] == '--- /dev/null\n'
+
+
+class TestDiffCommand:
+    def test_name_status(self, store, capsys):
+        store.session('s1', [
+            {'uuid': 'a', 'attrs': {'timestamp': 1.0, 'is_fresh_instance': True},
+             'files': [{'name': 'x', 'sha256': '1' * 64}, {'name': 'y', 'sha256': '2' * 64}]},
+            {'uuid': 'b', 'attrs': {'timestamp': 2.0},
+             'files': [{'name': 'x', 'sha256': '3' * 64}, {'name': 'z', 'sha256': '4' * 64}]},
+        ])
+
+        main(['--watcher-dir', str(store.watcher), '--snapshot-dir', str(store.snapshots), 'diff', 'a', 'b'])
+
+        assert capsys.readouterr().out == "A\tz\nM\tx\n"
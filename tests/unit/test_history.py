@@ -0,0 +1,168 @@
+"""
+Tests for history.py, the read-only reader of session quadstores.
+"""
+import os
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from history import History, read_session
+
+
+class TestReadSession:
+    """Decoding snapshots out of an owlready2-style quadstore"""
+
+    def test_reads_snapshots_in_order(self, store):
+        path = store.session('s1', [
+            {'uuid': 'a', 'attrs': {'clock': 'c:1', 'is_fresh_instance': True},
+             'files': [{'name': 'x.txt', 'sha256': '1' * 64, 'size': 3, 'exists': True}]},
+            {'uuid': 'b', 'files': []},
+        ])
+
+        snaps = read_session(path)
+
+        assert [s['uuid'] for s in snaps] == ['a', 'b']
+        assert snaps[0]['session'] == 's1'
+        assert snaps[0]['attrs'] == {'clock': 'c:1', 'is_fresh_instance': True}
+        assert snaps[0]['files'] == [{'name': 'x.txt', 'sha256': '1' * 64, 'size': 3, 'exists': True}]
+
+    def test_store_without_snapshots(self, store):
+        path = store.session('empty', [])
+
+        assert read_session(path) == []
+
+
+class TestHistory:
+    """Indexing, caching and diffing across sessions"""
+
+    @pytest.fixture
+    def history(self, store):
+        store.session('s1', [
+            {'uuid': 'a', 'files': [{'name': 'x.txt', 'sha256': '1' * 64}, {'name': 'y.txt', 'sha256': '2' * 64}]},
+        ])
+        store.session('s2', [
+            {'uuid': 'b', 'attrs': {'is_fresh_instance': True},
+             'files': [{'name': 'x.txt', 'sha256': '3' * 64}, {'name': 'z.txt', 'sha256': '4' * 64}]},
+        ])
+        os.utime(store.watcher / 's1.sqlite3', (1, 1))
+        history = History(store.watcher, store.snapshots)
+        history.refresh()
+        return history
+
+    def test_sessions_ordered_by_age(self, history):
+        assert [s['uuid'] for s in history.all()] == ['a', 'b']
+
+    def test_snapshots_of_concurrent_sessions_interleave_by_time(self, store):
+        store.session('r1', [{'uuid': 'r1-%d' % t, 'attrs': {'timestamp': float(t), 'root': '/r1'}, 'files': []}
+                             for t in (1, 3)])
+        store.session('r2', [{'uuid': 'r2-%d' % t, 'attrs': {'timestamp': float(t), 'root': '/r2'}, 'files': []}
+                             for t in (2, 4)])
+        history = History(store.watcher, store.snapshots)
+        history.refresh()
+
+        assert [s['uuid'] for s in history.all()] == ['r1-1', 'r2-2', 'r1-3', 'r2-4']
+
+    def test_file_history(self, history):
+        versions = history.file_history('x.txt')
+
+        assert [(v['snapshot'], v['sha256']) for v in versions] == [('a', '1' * 64), ('b', '3' * 64)]
+
+    def test_diff_uses_digests(self, history):
+        assert history.diff('a', 'b') == {'added': ['z.txt'], 'removed': ['y.txt'], 'modified': ['x.txt']}
+
+    def test_diff_unknown_point(self, history):
+        with pytest.raises(KeyError):
+            history.diff('a', 'nope')
+
+    def test_refresh_only_when_changed(self, history, store):
+        assert history.refresh() is False
+
+        store.session('s3', [{'uuid': 'c', 'files': [{'name': 'x.txt', 'sha256': '5' * 64}]}])
+
+        assert history.refresh() is True
+        assert len(history.file_history('x.txt')) == 3
+
+    def test_cache_dropped_on_refresh(self, history, store):
+        history.file_history('x.txt')
+        assert history._view.file_history.cache_info().currsize == 1
+
+        store.session('s3', [{'uuid': 'c', 'files': []}])
+        history.refresh()
+
+        assert history._view.file_history.cache_info().currsize == 0
+
+    def test_refresh_swaps_in_a_new_view(self, history, store):
+        old = history._view
+        history.file_history('x.txt')
+
+        store.session('s3', [{'uuid': 'c', 'files': [{'name': 'x.txt', 'sha256': '5' * 64}]}])
+        history.refresh()
+
+        # a query still holding the old view sees, and caches into, that view alone
+        assert history._view.generation == old.generation + 1
+        assert [s['uuid'] for s in old.ordered] == ['a', 'b'] and old.index == {'a': 0, 'b': 1}
+        assert len(old.file_history('x.txt')) == 2
+        assert len(history.file_history('x.txt')) == 3
+
+
+class TestIncrementalRefresh:
+    """A growing session store is read only where it grew"""
+
+    def test_appended_snapshots_read_without_rereading(self, store):
+        path = store.session('s1', [{'uuid': 'a', 'files': [{'name': 'x.txt', 'sha256': '1' * 64}]}])
+        history = History(store.watcher, store.snapshots)
+        history.refresh()
+        first = history.get('a')
+
+        store.session('s1', [{'uuid': 'b', 'files': [{'name': 'y.txt', 'sha256': '2' * 64}]}])
+        os.utime(path, ns=(path.stat().st_mtime_ns + 1, path.stat().st_mtime_ns + 1))
+
+        assert history.refresh() is True
+        assert [s['uuid'] for s in history.all()] == ['a', 'b']
+        assert history.get('a') is first
+        assert history.get('b')['files'] == [{'name': 'y.txt', 'sha256': '2' * 64}]
+
+    def test_replaced_store_read_again(self, store):
+        path = store.session('s1', [{'uuid': 'a', 'files': []}])
+        history = History(store.watcher, store.snapshots)
+        history.refresh()
+
+        # rewritten in place, so even the inode is the same
+        conn = sqlite3.connect(str(path))
+        conn.execute("UPDATE datas SET o = 'z'")
+        conn.commit()
+        conn.close()
+        os.utime(path, ns=(1, 1))
+        history.refresh()
+
+        assert [s['uuid'] for s in history.all()] == ['z']
+
+    def test_concurrent_refreshes(self, store):
+        import threading
+
+        history = History(store.watcher, store.snapshots)
+        errors = []
+
+        def refresh():
+            try:
+                for _ in range(20):
+                    history.refresh()
+                    history.all()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=refresh) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for i in range(20):
+            store.session('s%d' % i, [{'uuid': 'u%d' % i, 'files': []}])
+        for t in threads:
+            t.join()
+        history.refresh()
+
+        assert errors == []
+        assert len(history.all()) == 20
@@ -0,0 +1,47 @@
+"""
+Tests for inodes.py, the watcher's on-disk map of inodes to hashed content.
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from inodes import InodeIndex
+
+
+class TestInodeIndex:
+    def test_entry_round_trip(self):
+        index = InodeIndex()
+        index.put((1, 42), 'a.txt', 'ab' * 32, size=5, mtime_field='mtime_ns', mtime=10 ** 18, sha1='cd' * 20)
+
+        assert index.get((1, 42)) == {'name': 'a.txt', 'sha256': 'ab' * 32, 'size': 5,
+                                      'mtime_ns': 10 ** 18, 'content.sha1hex': 'cd' * 20}
+        assert index.get((2, 42)) is None
+        assert index.get(None) is None
+
+    def test_reput_replaces_entry(self):
+        index = InodeIndex()
+        index.put((None, 7), 'old.txt', '00' * 32)
+        index.put((None, 7), 'new.txt', '00' * 32)
+
+        assert len(index) == 1
+        assert index.get((None, 7))['name'] == 'new.txt'
+        assert index.named('old.txt') is None
+
+    def test_named_gives_latest(self):
+        index = InodeIndex()
+        index.put((1, 1), 'f.txt', '11' * 32)
+        index.put((1, 2), 'f.txt', '22' * 32)
+
+        assert index.named('f.txt')['sha256'] == '22' * 32
+
+    def test_forget(self):
+        index = InodeIndex()
+        index.put((1, 1), 'gone.txt', '11' * 32)
+        index.put((1, 2), 'kept.txt', '22' * 32)
+
+        index.forget('gone.txt')
+        index.commit()
+
+        assert index.get((1, 1)) is None
+        assert len(index) == 1
@@ -0,0 +1,100 @@
+"""
+Tests for server.py, the read-only HTTP view of the snapshot history.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+flask = pytest.importorskip("flask")
+
+from history import History
+from server import create_app
+
+
+@pytest.fixture
+def client(store):
+    content = b"hello world\n"
+    digest = store.blob(content)
+    store.session('s1', [
+        {'uuid': 'a', 'attrs': {'clock': 'c:1'}, 'files': [{'name': 'dir/x.txt', 'sha256': digest}]},
+        {'uuid': 'b', 'files': [{'name': 'dir/x.txt', 'sha256': '0' * 64}]},
+    ])
+    app = create_app(History(store.watcher, store.snapshots), refresh_interval=0)
+    client = app.test_client()
+    client.digest = digest
+    client.content = content
+    return client
+
+
+class TestServer:
+    def test_snapshots(self, client):
+        body = client.get('/snapshots').get_json()
+
+        assert body == [
+            {'uuid': 'a', 'session': 's1', 'attrs': {'clock': 'c:1'}, 'files': 1},
+            {'uuid': 'b', 'session': 's1', 'attrs': {}, 'files': 1},
+        ]
+
+    def test_snapshot_not_found(self, client):
+        assert client.get('/snapshots/nope').status_code == 404
+
+    def test_history_of_nested_path(self, client):
+        body = client.get('/history/dir/x.txt').get_json()
+
+        assert [v['snapshot'] for v in body] == ['a', 'b']
+
+    def test_diff(self, client):
+        body = client.get('/diff/a/b').get_json()
+
+        assert body == {'added': [], 'removed': [], 'modified': ['dir/x.txt']}
+
+    def test_diff_by_time(self, client):
+        assert client.get('/diff/0/1').get_json() == {'added': [], 'removed': [], 'modified': []}
+
+    def test_diff_unknown_point(self, client):
+        assert client.get('/diff/a/nope').status_code == 404
+
+    def test_file_diff(self, client, store):
+        new = store.blob(b"hello there\n")
+        store.session('s2', [{'uuid': 'c', 'files': [{'name': 'dir/x.txt', 'sha256': new}]}])
+        client.get('/snapshots')
+
+        body = client.get('/diff/a/c/dir/x.txt').get_data(as_text=True)
+
+        assert '-hello world\n' in body
+        assert '+hello there\n' in body
+
+    def test_blob(self, client):
+        response = client.get('/blobs/' + client.digest)
+
+        assert response.status_code == 200
+        assert response.data == client.content
+
+    def test_blob_range(self, client):
+        response = client.get('/blobs/' + client.digest, headers={'Range': 'bytes=6-10'})
+
+        assert response.status_code == 206
+        assert response.data == b"world"
+
+    def test_chunked_blob_range_and_etag(self, client, store):
+        from blobstore import BlobStore
+
+        content = bytes(range(256)) * 400
+        digest = BlobStore(store.snapshots, chunking=True, chunk_size=4096, chunk_min_file_size=1).put(content)
+        assert BlobStore(store.snapshots).chunks(digest) is not None
+
+        response = client.get('/blobs/' + digest, headers={'Range': 'bytes=10000-10999'})
+        assert response.status_code == 206
+        assert response.data == content[10000:11000]
+
+        etag = client.get('/blobs/' + digest).headers['ETag']
+        assert client.get('/blobs/' + digest, headers={'If-None-Match': etag}).status_code == 304
+
+    def test_blob_bad_digest(self, client):
+        assert client.get('/blobs/not-a-digest').status_code == 400
+
+    def test_blob_missing(self, client):
+        assert client.get('/blobs/' + 'f' * 64).status_code == 404
@@ -0,0 +1,249 @@
+"""
+Tests for sync.py, replication of sessions and blobs between nodes.
+"""
+import hashlib
+import io
+import random
+import sys
+import threading
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from blobstore import BlobStore
+from history import History
+from sync import BoundedReader, HttpNode, LocalNode, exchange, pull
+
+
+def node_of(store):
+    return LocalNode(store.root)
+
+
+def snapshot(uuid, *files):
+    return {'uuid': uuid, 'files': [{'name': name, 'sha256': digest} for name, digest in files]}
+
+
+def timed(uuid, timestamp, *files, fresh=False):
+    return dict(snapshot(uuid, *files), attrs={'timestamp': timestamp, 'is_fresh_instance': fresh})
+
+
+def uuids(store, origin=None):
+    history = History(store.watcher, store.snapshots, origin=origin)
+    history.refresh()
+    return [s['uuid'] for s in history.all()]
+
+
+class TestPull:
+    def test_copies_sessions_and_missing_blobs(self, make_store):
+        a, b = make_store('a'), make_store('b')
+        x, y = a.blob(b"x contents"), a.blob(b"y contents")
+        a.session('s1', [snapshot('one', ('x', x), ('y', y))])
+        b.blob(b"x contents")
+
+        stats = pull(node_of(a), node_of(b))
+
+        assert stats['sessions'] == 1
+        assert stats['blobs'] == 1
+        assert (b.snapshots / y).read_bytes() == b"y contents"
+        assert uuids(b) == []
+        assert uuids(b, origin=node_of(a).node_id()) == ['one']
+
+    def test_second_pull_transfers_nothing(self, make_store):
+        a, b = make_store('a'), make_store('b')
+        a.session('s1', [snapshot('one', ('x', a.blob(b"x")))])
+        pull(node_of(a), node_of(b))
+
+        assert pull(node_of(a), node_of(b)) == {'sessions': 0}
+
+    def test_changed_session_is_pulled_again(self, make_store):
+        a, b = make_store('a'), make_store('b')
+        a.session('s1', [snapshot('one', ('x', a.blob(b"x")))])
+        pull(node_of(a), node_of(b))
+
+        (a.watcher / 's1.sqlite3').unlink()
+        a.session('s1', [snapshot('one', ('x', a.blob(b"x"))), snapshot('two', ('x', a.blob(b"x2")))])
+        stats = pull(node_of(a), node_of(b))
+
+        assert stats == {'sessions': 1, 'blobs': 1, 'bytes': 2}
+
+    def test_shorter_copy_does_not_replace_held_session(self, make_store):
+        a, b = make_store('a'), make_store('b')
+        a.session('s1', [snapshot('one'), snapshot('two')])
+        pull(node_of(a), node_of(b))
+
+        (a.watcher / 's1.sqlite3').unlink()
+        a.session('s1', [snapshot('two')])
+        stats = pull(node_of(a), node_of(b))
+
+        assert stats == {'sessions': 0, 'skipped': 1}
+        assert uuids(b, origin=node_of(a).node_id()) == ['one', 'two']
+
+    def test_own_sessions_are_not_overwritten(self, make_store):
+        a, b = make_store('a'), make_store('b')
+        a.session('same', [snapshot('theirs')])
+        b.session('same', [snapshot('ours')])
+
+        pull(node_of(a), node_of(b))
+
+        assert uuids(b) == ['ours']
+        assert uuids(b, origin=node_of(a).node_id()) == ['theirs']
+
+    def test_diff_after_pull_ignores_other_nodes(self, make_store):
+        a, b = make_store('a'), make_store('b')
+        notes, todo, other = b.blob(b"notes"), b.blob(b"todo"), a.blob(b"other")
+        b.session('b1', [timed('b1', 10.0, ('notes.txt', notes), fresh=True)])
+        b.session('b2', [timed('b2', 30.0, ('todo.txt', todo))])
+        a.session('a1', [timed('a1', 20.0, ('other.txt', other), fresh=True)])
+
+        pull(node_of(a), node_of(b))
+        history = History(b.watcher, b.snapshots)
+        history.refresh()
+
+        assert history.diff(15, 35) == {'added': ['todo.txt'], 'removed': [], 'modified': []}
+        assert history.digests(15, 35)[1] == {'todo.txt': todo}
+        assert node_of(a).node_id() != node_of(b).node_id()
+
+    def test_exchange_both_ways(self, make_store):
+        a, b = make_store('a'), make_store('b')
+        a.session('sa', [snapshot('from-a', ('x', a.blob(b"from a")))])
+        b.session('sb', [snapshot('from-b', ('y', b.blob(b"from b")))])
+
+        exchange(node_of(a), node_of(b))
+
+        for store in (a, b):
+            assert sorted(p.name for p in store.watcher.rglob('*.sqlite3')) == ['sa.sqlite3', 'sb.sqlite3']
+        assert exchange(node_of(a), node_of(b)) == ({'sessions': 0}, {'sessions': 0})
+
+    def test_interrupted_pull_resumes(self, make_store):
+        a, b = make_store('a'), make_store('b')
+        digests = [a.blob(b"blob %d" % i) for i in range(10)]
+        a.session('s1', [snapshot('one', *(('f%d' % i, d) for i, d in enumerate(digests)))])
+        source = node_of(a)
+        objects = source.objects
+
+        def failing(wanted):
+            for i, item in enumerate(objects(wanted)):
+                if i == 4:
+                    raise ConnectionError("link dropped")
+                yield item
+
+        source.objects = failing
+        with pytest.raises(ConnectionError):
+            pull(source, node_of(b), batch_size=10)
+        assert list(b.watcher.rglob('*.sqlite3')) == []
+
+        stats = pull(node_of(a), node_of(b))
+
+        assert stats['blobs'] == 6
+        assert all((b.snapshots / d).exists() for d in digests)
+
+    def test_session_waits_for_missing_blobs(self, make_store):
+        a, b = make_store('a'), make_store('b')
+        content = b"arrives later"
+        digest = hashlib.sha256(content).hexdigest()
+        a.session('s1', [snapshot('one', ('x', digest))])
+
+        assert pull(node_of(a), node_of(b)) == {'sessions': 0, 'missing': 1, 'incomplete': 1}
+        assert list(b.watcher.rglob('*.sqlite3*')) == []
+
+        a.blob(content)
+        stats = pull(node_of(a), node_of(b))
+
+        assert stats['sessions'] == 1 and 'missing' not in stats
+        assert (b.snapshots / digest).read_bytes() == content
+        assert uuids(b, origin=node_of(a).node_id()) == ['one']
+
+    def test_chunk_hash_unavailable_here_counts_as_missing(self, make_store):
+        a, b = make_store('a'), make_store('b')
+        chunked = dict(chunking=True, chunk_hash='sha1', chunk_size=4096, chunk_min_file_size=1)
+        digest = BlobStore(a.snapshots, **chunked).put(b"x" * 20000)
+        a.session('s1', [snapshot('one', ('big', digest))])
+
+        with patch('blobstore.hashlib.algorithms_available', {'sha256'}):
+            stats = pull(node_of(a), node_of(b))
+
+        assert stats == {'sessions': 0, 'missing': 1, 'incomplete': 1}
+
+    def test_chunked_blobs_send_only_missing_chunks(self, make_store):
+        a, b = make_store('a'), make_store('b')
+        data = random.Random(1).getrandbits(8 * 200000).to_bytes(200000, 'big')
+        edited = data[:100000] + b"edit" + data[100000:]
+        chunked = dict(chunking=True, chunk_size=4096, chunk_min_file_size=1)
+        first = BlobStore(a.snapshots, **chunked).put(data)
+        a.session('s1', [snapshot('one', ('big', first))])
+        pull(node_of(a), node_of(b))
+
+        second = BlobStore(a.snapshots, **chunked).put(edited, previous=first)
+        a.session('s2', [snapshot('two', ('big', second))])
+        stats = pull(node_of(a), node_of(b))
+
+        assert stats['chunks'] <= 2
+        with BlobStore(b.snapshots).open(second) as f:
+            assert f.read() == edited
+
+    def test_corrupt_object_rejected(self, make_store):
+        a, b = make_store('a'), make_store('b')
+        digest = a.blob(b"genuine")
+        (a.snapshots / digest).write_bytes(b"tampered")
+        a.session('s1', [snapshot('one', ('x', digest))])
+
+        with pytest.raises(ValueError):
+            pull(node_of(a), node_of(b))
+
+
+class TestBoundedReader:
+    def test_reads_only_its_object(self):
+        f = io.BytesIO(b"abcdef")
+        reader = BoundedReader(f, 4)
+
+        assert reader.read(3) == b"abc"
+        assert reader.read() == b"d"
+        assert reader.read() == b""
+        assert f.read() == b"ef"
+
+    def test_stream_ending_early(self):
+        with pytest.raises(ValueError):
+            BoundedReader(io.BytesIO(b"abc"), 4).drain()
+
+
+class TestHttpNode:
+    @pytest.fixture
+    def served(self, make_store):
+        from werkzeug.serving import make_server
+        from server import create_app
+
+        a = make_store('a')
+        app = create_app(History(a.watcher, a.snapshots))
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield a, 'http://127.0.0.1:%d' % server.server_port
+        server.shutdown()
+
+    def test_objects_stream_in_blocks(self, served, make_store):
+        a, url = served
+        b = make_store('b')
+        data = random.Random(2).getrandbits(8 * 5000).to_bytes(5000, 'big')
+        digest = a.blob(data)
+        a.session('s1', [snapshot('one', ('x', digest))])
+
+        with patch('sync.BLOCK_SIZE', 64), patch('blobstore.BLOCK_SIZE', 64):
+            stats = pull(HttpNode(url), node_of(b))
+
+        assert stats['bytes'] == 5000
+        assert (b.snapshots / digest).read_bytes() == data
+
+    def test_pull_over_http(self, served, make_store):
+        a, url = served
+        b = make_store('b')
+        x = a.blob(b"x contents")
+        a.session('s1', [snapshot('one', ('x', x))])
+
+        stats = pull(HttpNode(url), node_of(b))
+
+        assert stats == {'sessions': 1, 'blobs': 1, 'bytes': 10}
+        assert (b.snapshots / x).read_bytes() == b"x contents"
+        assert pull(HttpNode(url), node_of(b)) == {'sessions': 0}
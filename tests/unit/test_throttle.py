@@ -0,0 +1,133 @@
+"""
+Tests for throttle.py, pacing and deferral of the watcher's I/O.
+"""
+import io
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from throttle import RateLimiter, Scheduler, lower_priority
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TestRateLimiter:
+    def test_burst_then_paced(self):
+        clock = FakeClock()
+        limiter = RateLimiter(100, clock, clock.sleep)
+
+        limiter.consume(100)
+        assert clock.slept == []
+        limiter.consume(50)
+        assert clock.slept == [0.5]
+
+    def test_tokens_refill_over_time(self):
+        clock = FakeClock()
+        limiter = RateLimiter(100, clock, clock.sleep)
+        limiter.consume(100)
+
+        clock.now += 10
+        limiter.consume(100)
+        assert clock.slept == []
+
+    def test_average_rate_holds(self):
+        clock = FakeClock()
+        limiter = RateLimiter(1000, clock, clock.sleep)
+        for _ in range(100):
+            limiter.consume(100)
+
+        # 10000 bytes at 1000/s, less the one second burst
+        assert clock.now == pytest.approx(9.0)
+
+
+class TestScheduler:
+    def test_read_unthrottled(self):
+        assert Scheduler().read(io.BytesIO(b"contents")) == b"contents"
+
+    def test_read_throttled_in_blocks(self):
+        clock = FakeClock()
+        scheduler = Scheduler(read_rate=1024 * 1024, clock=clock, sleep=clock.sleep)
+        data = b"x" * (3 * 1024 * 1024)
+
+        assert scheduler.read(io.BytesIO(data)) == data
+        assert clock.now == pytest.approx(2.0)
+
+    def test_writes_paced(self):
+        clock = FakeClock()
+        scheduler = Scheduler(write_rate=10, clock=clock, sleep=clock.sleep)
+        scheduler.wrote(30)
+        assert clock.slept == [2.0]
+
+    def test_large_files_deferred_until_settled(self):
+        clock = FakeClock()
+        scheduler = Scheduler(settle_seconds=5, settle_min_file_size=100, clock=clock)
+        big, small = {'name': 'big', 'size': 100}, {'name': 'small', 'size': 99}
+
+        scheduler.touch()
+        assert scheduler.should_defer(big)
+        assert not scheduler.should_defer(small)
+        scheduler.defer(big)
+
+        clock.now += 4
+        assert scheduler.due() == {}
+        clock.now += 1
+        assert scheduler.due() == {None: [big]}
+        assert scheduler.due() == {}
+
+    def test_latest_entry_wins_and_discard(self):
+        scheduler = Scheduler(settle_seconds=5, settle_min_file_size=1)
+        scheduler.defer({'name': 'a', 'size': 1})
+        scheduler.defer({'name': 'a', 'size': 2})
+        scheduler.defer({'name': 'b', 'size': 1})
+        scheduler.discard('b')
+
+        assert scheduler.due() == {None: [{'name': 'a', 'size': 2}]}
+
+    def test_held_at_most_settle_max_seconds(self):
+        clock = FakeClock()
+        scheduler = Scheduler(settle_seconds=5, settle_min_file_size=1, settle_max_seconds=60, clock=clock)
+        scheduler.defer({'name': 'log', 'size': 1}, '/watched')
+        scheduler.defer({'name': 'new', 'size': 1}, '/watched')
+
+        for _ in range(20):
+            # an update every few seconds: the tree never settles
+            clock.now += 3
+            scheduler.touch()
+            scheduler.defer({'name': 'log', 'size': int(clock.now)}, '/watched')
+            if clock.now < 60:
+                assert scheduler.due() == {}
+        assert scheduler.due() == {'/watched': [{'name': 'log', 'size': 60}, {'name': 'new', 'size': 1}]}
+
+    def test_nothing_deferred_by_default(self):
+        scheduler = Scheduler()
+        scheduler.touch()
+        assert not scheduler.should_defer({'name': 'huge', 'size': 1 << 40})
+
+
+class TestLowerPriority:
+    def test_nice_and_ionice(self):
+        with patch('os.nice') as nice, patch('subprocess.run') as run, \
+                patch('shutil.which', return_value='/usr/bin/ionice'), patch('sys.platform', 'linux'):
+            lower_priority(10, 'idle')
+
+        nice.assert_called_once_with(10)
+        assert run.call_args[0][0][:3] == ['/usr/bin/ionice', '-c', '3']
+
+    def test_unknown_ionice_class(self):
+        with pytest.raises(ValueError):
+            lower_priority(None, 'realtime')
@@ -64,7 +64,13 @@ class TestWatcherFunctions:
             def __init__(self, uuid=None):
                 self.uuid4 = []
                 self.sha256 = []
-        
+
+            def __getattr__(self, name):
+                # Properties declared at runtime behave like owlready2 lists
+                value = []
+                setattr(self, name, value)
+                return value
+
         class MockSnapshot:
             def __init__(self, uuid=None):
                 self.uuid4 = []
@@ -141,7 +147,7 @@ class TestWatcherFunctions:
         
         file_info = {'name': 'test.txt'}
         
-        with patch('builtins.open', mock_open(read_data=test_content.decode('utf8'))):
+        with patch('builtins.open', mock_open(read_data=test_content)):
             result = watcher.update_file_handler(file_info)
         
         assert result == test_hash
@@ -196,7 +202,7 @@ class TestWatcherFunctions:
         
         file_info = {'name': 'snapshot_test.txt'}
         
-        mock_file = mock_open(read_data=test_content.decode('utf8'))
+        mock_file = mock_open(read_data=test_content)
         
         with patch('builtins.open', mock_file):
             result = watcher.update_file_handler(file_info)
@@ -369,6 +375,231 @@ class TestWatcherFunctions:
                 # Verify 'name' is converted to 'filename'
                 assert hasattr(mock_file, 'filename')
     
+    def test_update_handler_deletion_is_tombstone(self, mock_watcher_onto):
+        """Deleted files are recorded from watchman metadata without opening them"""
+        import watcher
+        watcher.path = self.temp_dir
+        watcher.snapshot_path = self.snapshot_dir
+
+        update = {'files': [{'name': 'gone.txt', 'exists': False, 'ino': 7}]}
+
+        with patch('uuid.uuid4', return_value='test-uuid'):
+            with patch.object(watcher, 'update_file_handler') as mock_handler:
+                watcher.update_handler(update)
+
+        mock_handler.assert_not_called()
+        mock_watcher_onto.default_world.save.assert_called()
+
+    def test_update_file_handler_rename_reuses_digest(self, mock_watcher_onto):
+        """A file seen under a new name with the same inode and stat is not reread"""
+        import watcher
+        watcher.path = self.temp_dir
+        watcher.snapshot_path = self.snapshot_dir
+
+        content = b"moved content"
+        digest = hashlib.sha256(content).hexdigest()
+        stat = {'ino': 42, 'dev': 1, 'size': len(content), 'mtime_ns': 1000}
+
+        with patch('builtins.open', mock_open(read_data=content)):
+            assert watcher.update_file_handler(dict(stat, name='old.txt')) == digest
+
+        with patch('builtins.open', side_effect=AssertionError("should not read")):
+            assert watcher.update_file_handler(dict(stat, name='new.txt')) == digest
+
+        assert watcher.inodes.get((1, 42))['name'] == 'new.txt'
+
+    def test_update_file_handler_same_inode_new_content(self, mock_watcher_onto):
+        """A changed mtime on a known inode means the file must be rehashed"""
+        import watcher
+        watcher.path = self.temp_dir
+        watcher.snapshot_path = self.snapshot_dir
+
+        with patch('builtins.open', mock_open(read_data=b"v1")):
+            watcher.update_file_handler({'name': 'f.txt', 'ino': 3, 'size': 2, 'mtime_ns': 1})
+
+        mock_file = mock_open(read_data=b"v2")
+        with patch('builtins.open', mock_file):
+            result = watcher.update_file_handler({'name': 'f.txt', 'ino': 3, 'size': 2, 'mtime_ns': 2})
+
+        assert mock_file.call_count >= 1
+        assert result == hashlib.sha256(b"v2").hexdigest()
+
+    def test_update_handler_records_rename(self, mock_watcher_onto):
+        """A move within one update keeps the inode entry under its new name"""
+        import watcher
+        watcher.path = self.temp_dir
+        watcher.snapshot_path = self.snapshot_dir
+
+        stat = {'ino': 9, 'size': 4, 'mtime': 5}
+        with patch('builtins.open', mock_open(read_data=b"data")):
+            watcher.update_file_handler(dict(stat, name='dir/a.txt'))
+
+        update = {'files': [
+            {'name': 'dir/a.txt', 'exists': False},
+            dict(stat, name='moved/a.txt', exists=True),
+        ]}
+        with patch('uuid.uuid4', return_value='test-uuid'):
+            with patch('builtins.open', side_effect=AssertionError("should not read")):
+                watcher.update_handler(update)
+
+        assert watcher.inodes.get((None, 9))['name'] == 'moved/a.txt'
+        assert watcher.inodes.named('dir/a.txt') is None
+
+    def test_forget_deleted_file(self, mock_watcher_onto):
+        """Inode entries of deleted, unmoved files are dropped"""
+        import watcher
+        watcher.path = self.temp_dir
+        watcher.snapshot_path = self.snapshot_dir
+
+        with patch('builtins.open', mock_open(read_data=b"data")):
+            watcher.update_file_handler({'name': 'a.txt', 'ino': 9, 'size': 4, 'mtime': 5})
+
+        watcher.forget(['a.txt'])
+
+        assert len(watcher.inodes) == 0
+
+    def test_update_handler_ingests_in_slices(self, mock_watcher_onto):
+        """Large updates are committed and caches released once per slice"""
+        import watcher
+        watcher.settings = dict(watcher.settings, ingest_batch_size=2)
+        files = [{'name': 'f%d.txt' % i} for i in range(5)]
+
+        with patch('uuid.uuid4', return_value='test-uuid'):
+            with patch.object(watcher, 'update_file_handler', return_value='mock-sha'):
+                watcher.update_handler({'files': files})
+
+        assert mock_watcher_onto.release_entity_cache.call_count == 3
+        assert files == [None] * 5
+
+    def test_update_handler_shrinks_slices_over_memory_limit(self, mock_watcher_onto):
+        """Exceeding memory_limit_mb halves the slice size"""
+        import watcher
+        watcher.settings = dict(watcher.settings, ingest_batch_size=4, memory_limit_mb=1)
+        files = [{'name': 'f%d.txt' % i} for i in range(7)]
+
+        with patch('uuid.uuid4', return_value='test-uuid'):
+            with patch.object(watcher, 'update_file_handler', return_value='mock-sha'):
+                with patch.object(watcher, 'resident_memory', return_value=2 * 1024 * 1024):
+                    with patch('builtins.print') as mock_print:
+                        watcher.update_handler({'files': files})
+
+        # slices of 4, 2 and 1
+        assert mock_watcher_onto.release_entity_cache.call_count == 3
+        mock_print.assert_any_call("resident memory over 1 MB, ingesting 2 files at a time")
+
+    def test_update_handler_slices_stop_shrinking_at_floor(self, mock_watcher_onto):
+        """Slices never shrink below a sixteenth of ingest_batch_size"""
+        import watcher
+        watcher.settings = dict(watcher.settings, ingest_batch_size=32, memory_limit_mb=1)
+        files = [{'name': 'f%d.txt' % i} for i in range(64)]
+
+        with patch('uuid.uuid4', return_value='test-uuid'):
+            with patch.object(watcher, 'update_file_handler', return_value='mock-sha'):
+                with patch.object(watcher, 'resident_memory', return_value=2 * 1024 * 1024):
+                    with patch('builtins.print'):
+                        watcher.update_handler({'files': files})
+
+        # slices of 32, 16, 8, 4, 2 and 2
+        assert mock_watcher_onto.release_entity_cache.call_count == 6
+
+    def test_large_files_deferred_while_tree_changes(self, mock_watcher_onto):
+        """Large files are hashed only once updates stop arriving"""
+        import throttle
+        import watcher
+        watcher.scheduler = throttle.Scheduler(settle_seconds=30, settle_min_file_size=1000)
+        update = {'files': [{'name': 'big.iso', 'size': 5000}, {'name': 'small.txt', 'size': 10}]}
+
+        watcher.scheduler.touch()
+        with patch('uuid.uuid4', return_value='test-uuid'):
+            with patch.object(watcher, 'update_file_handler', return_value='mock-sha') as hashed:
+                watcher.update_handler(update)
+                assert [c[0][0]['name'] for c in hashed.call_args_list] == ['small.txt']
+
+                watcher.scheduler.last_update -= 30
+                watcher.update_handler({'files': watcher.scheduler.due()[None]})
+                assert hashed.call_args_list[-1][0][0]['name'] == 'big.iso'
+
+        assert watcher.scheduler.deferred == {}
+
+    def test_fresh_instance_hashes_large_files_at_once(self, mock_watcher_onto):
+        """A full crawl records every file, even while the tree is changing"""
+        import throttle
+        import watcher
+        watcher.scheduler = throttle.Scheduler(settle_seconds=30, settle_min_file_size=1000)
+        update = {'is_fresh_instance': True, 'files': [{'name': 'big.iso', 'size': 5000}]}
+
+        watcher.scheduler.touch()
+        with patch('uuid.uuid4', return_value='test-uuid'):
+            with patch.object(watcher, 'update_file_handler', return_value='mock-sha') as hashed:
+                watcher.update_handler(update)
+
+        assert [c[0][0]['name'] for c in hashed.call_args_list] == ['big.iso']
+        assert watcher.scheduler.deferred == {}
+
+    def test_diff_from_restart_to_deferred_snapshot(self, mock_watcher_onto):
+        """A large file changed after a restart diffs as modified, and a later crawl can remove it"""
+        import throttle
+        import watcher
+        from diff import diff
+        watcher.scheduler = throttle.Scheduler(settle_seconds=30, settle_min_file_size=1000)
+        snapshots = []
+
+        def record(uuid, update):
+            files = []
+
+            def hash_file(item):
+                files.append({'name': item['name'], 'sha256': '%s@%d' % (item['name'], item['size'])})
+                return files[-1]['sha256']
+
+            with patch.object(watcher, 'update_file_handler', side_effect=hash_file):
+                watcher.update_handler(update)
+            attrs = {'timestamp': float(len(snapshots)), 'root': update['root'],
+                     'is_fresh_instance': bool(update.get('is_fresh_instance'))}
+            snapshots.append({'uuid': uuid, 'attrs': attrs, 'files': files})
+
+        with patch('uuid.uuid4', return_value='test-uuid'):
+            # watchman reports the resolved root, not the path the watcher was started with
+            watcher.scheduler.touch()
+            record('restart', {'is_fresh_instance': True, 'root': '/real/tree',
+                               'files': [{'name': 'big.iso', 'size': 5000}, {'name': 'small.txt', 'size': 10}]})
+            watcher.scheduler.touch()
+            record('busy', {'root': '/real/tree', 'files': [{'name': 'big.iso', 'size': 6000}]})
+            watcher.scheduler.last_update -= 30
+            (root, files), = watcher.scheduler.due().items()
+            record('settled', {'files': files, 'root': root, 'deferred': True})
+            record('recrawl', {'is_fresh_instance': True, 'root': '/real/tree',
+                               'files': [{'name': 'small.txt', 'size': 10}]})
+
+        assert root == '/real/tree'
+        assert diff(snapshots, 'restart', 'settled') == {'added': [], 'removed': [], 'modified': ['big.iso']}
+        assert diff(snapshots, 'settled', 'recrawl') == {'added': [], 'removed': ['big.iso'], 'modified': []}
+
+    def test_update_file_handler_reads_bytes(self, mock_watcher_onto):
+        """Files are read in binary, so read pacing counts bytes, and hashed as text as before"""
+        import watcher
+        watcher.path = self.temp_dir
+        watcher.snapshot_path = self.snapshot_dir
+
+        mock_file = mock_open(read_data="caf\u00e9\r\n".encode('utf8'))
+        with patch('builtins.open', mock_file):
+            result = watcher.update_file_handler({'name': 'crlf.txt'})
+
+        assert mock_file.call_args_list[0][0][1] == 'rb'
+        assert result == hashlib.sha256("caf\u00e9\n".encode('utf8')).hexdigest()
+
+    def test_properties_declared_once(self, mock_watcher_onto):
+        """Each property is only created the first time it is seen"""
+        import watcher
+
+        update = {'files': [{'name': 'a.txt', 'size': 1}, {'name': 'b.txt', 'size': 2}]}
+        with patch('uuid.uuid4', return_value='test-uuid'):
+            with patch.object(watcher, 'update_file_handler', return_value='mock-sha'):
+                watcher.update_handler(update)
+
+        names = [c[0][0] for c in mock_watcher_onto.property_type.call_args_list]
+        assert names.count('size') == 1
+        assert names.count('filename') == 1
+
     def test_path_traversal_protection(self, mock_watcher_onto):
         """Test protection against path traversal attacks"""
         import watcher
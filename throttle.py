@@ -0,0 +1,135 @@
+"""Keeping ingestion from starving the host.
+
+During a large checkout or build the watcher is told about files while the
+user's tools are still writing them.  The `Scheduler` here paces the daemon's
+disk I/O with token buckets on bytes read and bytes written, and holds back
+hashing of large files until no update has arrived for a while, so they are
+read once when the tree has settled instead of on every intermediate write,
+or at the latest once they have waited settle_max_seconds.
+The full crawl of a fresh instance is never held back: it must list every file.
+`lower_priority` additionally drops the process's CPU and I/O priority.
+
+All limits come from config.py and can be set per watch root.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+BLOCK_SIZE = 1024 * 1024
+IONICE_CLASSES = {'best-effort': '2', 'idle': '3'}
+
+
+class RateLimiter:
+    """Token bucket: `consume` sleeps as needed to keep throughput at `rate` bytes per second.
+
+    Up to one second's worth of bytes may pass in a burst after a quiet
+    spell; a consume larger than the bucket is let through and repaid by
+    sleeping afterwards.
+    """
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = rate
+        self.last = clock()
+
+    def consume(self, n):
+        now = self.clock()
+        self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate) - n
+        self.last = now
+        if self.tokens < 0:
+            self.sleep(-self.tokens / self.rate)
+
+
+class Scheduler:
+    """Paces the watcher's reads and writes and defers hashing of large files until the tree settles."""
+
+    def __init__(self, read_rate=None, write_rate=None, settle_seconds=0, settle_min_file_size=None,
+                 settle_max_seconds=None, clock=time.monotonic, sleep=time.sleep):
+        self.reads = RateLimiter(read_rate, clock, sleep) if read_rate else None
+        self.writes = RateLimiter(write_rate, clock, sleep) if write_rate else None
+        self.settle_seconds = settle_seconds
+        self.settle_min_file_size = settle_min_file_size
+        self.settle_max_seconds = settle_max_seconds
+        self.clock = clock
+        self.last_update = None
+        # name -> (watch root, the latest watchman entry, when it was first held) for a file waiting to be hashed
+        self.deferred = {}
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(settings['read_bytes_per_second'], settings['write_bytes_per_second'],
+                   settings['settle_seconds'], settings['settle_min_file_size'], settings['settle_max_seconds'])
+
+    def read(self, f):
+        """Read all of binary file `f`, no faster than the read limit allows."""
+        if self.reads is None:
+            return f.read()
+        parts = []
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                return b"".join(parts)
+            self.reads.consume(len(block))
+            parts.append(block)
+
+    def wrote(self, n):
+        if self.writes is not None and n:
+            self.writes.consume(n)
+
+    def touch(self):
+        """Note that an update just arrived, i.e. the tree is still changing."""
+        self.last_update = self.clock()
+
+    def settled(self):
+        return self.last_update is None or self.clock() - self.last_update >= self.settle_seconds
+
+    def should_defer(self, file):
+        size = file.get('size')
+        return (bool(self.settle_seconds) and self.settle_min_file_size is not None
+                and isinstance(size, int) and size >= self.settle_min_file_size and not self.settled())
+
+    def defer(self, file, root=None):
+        """Hold `file`, reported by the watch on `root`, until the tree settles."""
+        held = self.deferred.get(file['name'])
+        self.deferred[file['name']] = (root, file, held[2] if held else self.clock())
+
+    def discard(self, name):
+        self.deferred.pop(name, None)
+
+    def due(self):
+        """{root: [files]} no longer held: all of them once the tree has settled, else those held too long.
+
+        A tree that never goes quiet would hold its large files forever, so a
+        file is released after settle_max_seconds however busy the tree is.
+        """
+        if not self.deferred:
+            return {}
+        if self.settled():
+            names = list(self.deferred)
+        elif self.settle_max_seconds is not None:
+            oldest = self.clock() - self.settle_max_seconds
+            names = [name for name, (_, _, since) in self.deferred.items() if since <= oldest]
+        else:
+            names = []
+        due = {}
+        for name in names:
+            root, file, _ = self.deferred.pop(name)
+            due.setdefault(root, []).append(file)
+        return due
+
+
+def lower_priority(niceness=None, ionice_class=None):
+    """Raise this process's niceness by `niceness` and, on Linux, move it to I/O class `ionice_class`."""
+    if niceness:
+        os.nice(niceness)
+    if ionice_class is None:
+        return
+    if ionice_class not in IONICE_CLASSES:
+        raise ValueError("unknown ionice class %r, expected one of %s" % (ionice_class, ", ".join(IONICE_CLASSES)))
+    ionice = shutil.which('ionice')
+    if sys.platform.startswith('linux') and ionice:
+        subprocess.run([ionice, '-c', IONICE_CLASSES[ionice_class], '-p', str(os.getpid())], check=False)
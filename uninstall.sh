@@ -50,6 +50,9 @@ elif [[ "$OS_TYPE" == "macos" ]]; then
     rm -f /var/log/${PROJECT_NAME}.error.log
 fi
 
+echo "Removing the versions command..."
+rm -f /usr/local/bin/${PROJECT_NAME}
+
 echo "Removing installation directory..."
 rm -rf "$INSTALL_DIR"
 
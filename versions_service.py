@@ -0,0 +1,128 @@
+import argparse
+import sys
+
+
+def serve(args):
+    from history import History
+    from server import create_app
+
+    history = History(args.watcher_dir, args.snapshot_dir, cache_size=args.cache_size, origin=args.origin)
+    create_app(history).run(host=args.host, port=args.port, threaded=True)
+
+
+def diff(args):
+    from diff import diff_trees, line_diff
+    from history import History
+
+    history = History(args.watcher_dir, args.snapshot_dir, origin=args.origin)
+    history.refresh()
+    try:
+        old, new = history.digests(args.a, args.b)
+    except KeyError as e:
+        sys.exit("versions: unknown snapshot or time %s" % e)
+    if args.paths:
+        paths = set(args.paths)
+        old = {n: d for n, d in old.items() if n in paths}
+        new = {n: d for n, d in new.items() if n in paths}
+
+    changes = diff_trees(old, new)
+    for status, key in (('A', 'added'), ('D', 'removed'), ('M', 'modified')):
+        for name in changes[key]:
+            if args.lines:
+                sys.stdout.writelines(line_diff(history.snapshots, name, old.get(name), new.get(name)))
+            else:
+                print("%s\t%s" % (status, name))
+
+
+def sync(args):
+    from sync import LocalNode, exchange, node, pull
+
+    if args.origin:
+        sys.exit("versions: --origin does not apply to sync; it pulls into this node's store")
+    dest = LocalNode(watcher=args.watcher_dir, snapshots=args.snapshot_dir)
+    source = node(args.source)
+    if args.both:
+        if not isinstance(source, LocalNode):
+            sys.exit("versions: --both needs a local source")
+        results = exchange(source, dest, args.batch_size)
+    else:
+        results = (pull(source, dest, args.batch_size),)
+    for stats in results:
+        print(" ".join("%s=%d" % item for item in sorted(stats.items())))
+
+
+def export(args):
+    from archive import export
+    from sync import LocalNode
+
+    source = LocalNode(watcher=args.watcher_dir, snapshots=args.snapshot_dir)
+    try:
+        stats = export(source, args.archive, args.since, args.until, args.origin)
+    except KeyError as e:
+        sys.exit("versions: unknown snapshot or time %s" % e)
+    print(" ".join("%s=%d" % item for item in sorted(stats.items())))
+
+
+def import_(args):
+    from archive import import_archive
+    from sync import LocalNode
+
+    if args.origin:
+        sys.exit("versions: --origin does not apply to import; sessions are filed under the archive's origin")
+    dest = LocalNode(watcher=args.watcher_dir, snapshots=args.snapshot_dir)
+    try:
+        stats = import_archive(args.archive, dest, args.batch_size)
+    except ValueError as e:
+        sys.exit("versions: %s" % e)
+    print(" ".join("%s=%d" % item for item in sorted(stats.items())))
+
+
+def parser():
+    p = argparse.ArgumentParser(prog="versions", description="Browse and manage versions snapshot history")
+    p.add_argument("--watcher-dir", help="directory of session stores (default ~/.watcher)")
+    p.add_argument("--snapshot-dir", help="directory of blobs (default ~/.snapshots)")
+    p.add_argument("--origin",
+                   help="browse or export the sessions replicated from this node id instead of this node's own")
+    commands = p.add_subparsers(dest="command", required=True)
+
+    s = commands.add_parser("serve", help="serve history, diffs and blobs over HTTP (read-only)")
+    s.add_argument("--host", default="127.0.0.1")
+    s.add_argument("--port", type=int, default=8765)
+    s.add_argument("--cache-size", type=int, default=1024, help="entries in the metadata query LRU cache")
+    s.set_defaults(func=serve)
+
+    d = commands.add_parser("diff", help="show paths changed between two snapshots or points in time")
+    d.add_argument("a", help="snapshot uuid, epoch seconds or ISO 8601 time")
+    d.add_argument("b", help="snapshot uuid, epoch seconds or ISO 8601 time")
+    d.add_argument("paths", nargs="*", help="limit the diff to these paths")
+    d.add_argument("-l", "--lines", action="store_true", help="print unified line diffs read from the blob store")
+    d.set_defaults(func=diff)
+
+    y = commands.add_parser("sync", help="pull snapshots and missing blobs from another node")
+    y.add_argument("source",
+                   help="URL of a node running 'versions serve', or a directory holding .watcher and .snapshots")
+    y.add_argument("--both", action="store_true", help="also push to a local source")
+    y.add_argument("--batch-size", type=int, default=256, help="objects requested per round trip")
+    y.set_defaults(func=sync)
+
+    e = commands.add_parser("export", help="write snapshots and the blobs they reference to one archive file")
+    e.add_argument("archive", help="path of the archive to write")
+    e.add_argument("--since", help="only snapshots after this snapshot uuid or time")
+    e.add_argument("--until", help="only snapshots up to and including this snapshot uuid or time")
+    e.set_defaults(func=export)
+
+    i = commands.add_parser("import", help="add the snapshots and blobs in an archive to this node")
+    i.add_argument("archive", help="path of an archive written by 'versions export'")
+    i.add_argument("--batch-size", type=int, default=256, help="objects read per batch")
+    i.set_defaults(func=import_)
+
+    return p
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
-import hashlib
+import gc
+import io
 import os
+import time
 import pywatchman
 from functools import reduce
 from glob import glob
@@ -7,7 +9,11 @@ from sys import argv
 from pathlib import Path
 from uuid import uuid4
 import types
+import config
+import throttle
 import watcher_onto
+from blobstore import BlobStore
+from inodes import InodeIndex
 from watcher_onto import onto, owlready_builtin_datatypes, default_world, property_type
 
 watcher_onto.start_session()
@@ -25,6 +31,10 @@ get_onto_classes()
 
 
 path = argv[1]
+settings = config.load(path)
+if settings['memory_limit_mb'] is not None:
+    watcher_onto.limit_store_memory(max(1, settings['memory_limit_mb'] // 4))
+scheduler = throttle.Scheduler.from_settings(settings)
 snapshot_path =  Path.home() / '.snapshots'
 try:
     os.mkdir(snapshot_path)
@@ -38,51 +48,184 @@ def update_handler(update):
         uuid = str(uuid4())
         thing = Snapshot(uuid)
         thing.uuid4.append(uuid)
+        declare('timestamp', Snapshot, float)
+        thing.timestamp.append(time.time())
+        deleted = []
+        # a fresh instance is a full crawl: a file left out of it would read as removed
+        settle = not update.get('is_fresh_instance')
 
         for key, value in update.items():
             with onto:
                 if type(value) in owlready_builtin_datatypes:
-                    property_type(key, Snapshot, type(value))
+                    declare(key, Snapshot, type(value))
                     #print("setattr(%s, %s, %s)" % (thing, key, value))
                     getattr(thing, key).append(value)
                 elif type(value) == list and key == 'files':
-                    for i, item in enumerate(value):
-                        if type(item) == dict:
-                            file_uuid = str(uuid4())
-                            file = File(file_uuid)
-                            file.uuid4.append(file_uuid)
-
-                            sha256 = update_file_handler(item)
-                            if type(sha256) != str:
-                                continue
-                            property_type('sha256', Thing, str)
-                            file.sha256.append(sha256)
-                            thing.files.append(file)
-
-                            for subkey, subval in item.items():
-                                #setattr(getattr(thing, key), 'append', file)
-                                #print("setattr(%s, %s, %s)" % (file, subkey, subval))
-                                setattr(file, ('filename' if (subkey == "name") else subkey), subval)
-                        else:
-                            print("files should only contain dicts shouldn't it? %s" % item)
+                    files_handler(thing, value, deleted, settle, update.get('root'))
                 else:
                     print("value for key %s is of unsupported type %s" % (key, type(value)))
                 default_world.save()
+        forget(deleted)
     else:
         print("update with no 'files' entry ", update)
 
 
-def update_file_handler(file):
+def files_handler(thing, files, deleted, settle=True, root=None):
+    """Record `files` against snapshot `thing` in slices, keeping memory bounded on huge updates.
+
+    Each slice is committed and owlready2's entity cache released before the
+    next, and entries are removed from `files` as they are recorded so the
+    update itself shrinks as it is consumed.  While resident memory exceeds
+    memory_limit_mb, garbage is collected and the slice size halved, down to a
+    sixteenth of ingest_batch_size.
+    """
+    batch = settings['ingest_batch_size']
+    smallest = max(1, batch // 16)
+    limit = settings['memory_limit_mb']
+    start = 0
+    while start < len(files):
+        end = min(start + batch, len(files))
+        for i in range(start, end):
+            item = files[i]
+            files[i] = None
+            if type(item) == dict:
+                file_handler(thing, item, deleted, settle, root)
+            else:
+                print("files should only contain dicts shouldn't it? %s" % item)
+        default_world.save()
+        inodes.commit()
+        watcher_onto.release_entity_cache()
+        if limit is not None and batch > smallest and resident_memory() > limit * 1024 * 1024:
+            gc.collect()
+            batch = max(smallest, batch // 2)
+            print("resident memory over %d MB, ingesting %d files at a time" % (limit, batch))
+        start = end
+
+
+def file_handler(thing, item, deleted, settle=True, root=None):
+    if settle and item.get('exists') is not False and scheduler.should_defer(item):
+        # large and the tree is still changing: hash it once things settle, in a later snapshot
+        # filed under the same watchman root, so a later fresh instance of that root replaces it
+        scheduler.defer(item, root)
+        return
+    scheduler.discard(item.get('name'))
+
+    file_uuid = str(uuid4())
+    file = File(file_uuid)
+    file.uuid4.append(file_uuid)
+
+    if item.get('exists') is False:
+        # tombstone: recorded from watchman's metadata alone, nothing to read
+        deleted.append(item.get('name'))
+    else:
+        prior = inodes.get(inode_key(item))
+        sha256 = update_file_handler(item)
+        if type(sha256) != str:
+            return
+        declare('sha256', Thing, str)
+        file.sha256.append(sha256)
+        if prior is not None and prior['name'] != item.get('name') and prior['sha256'] == sha256:
+            declare('renamed_from', File, str)
+            file.renamed_from.append(prior['name'])
+    # thing.files.append() copies the whole list on every call and keeps every File alive,
+    # so add the triple directly
+    onto._add_obj_triple_spo(thing.storid, onto.files.storid, file.storid)
+
+    for subkey, subval in item.items():
+        # declare each field as a property so it is persisted to the quadstore
+        # rather than living only on the python object
+        if type(subval) not in owlready_builtin_datatypes:
+            continue
+        subkey = 'filename' if (subkey == "name") else subkey
+        declare(subkey, File, type(subval))
+        getattr(file, subkey).append(subval)
+
+
+# property_type creates a class and commits; only do that the first time a property is seen
+declared = set()
+
+
+def declare(name, domain, range_type):
+    if (name, domain, range_type) not in declared:
+        property_type(name, domain, range_type)
+        declared.add((name, domain, range_type))
+
+
+def resident_memory():
+    """Current resident set size in bytes (peak on platforms without /proc)."""
     try:
-        with open(path + '/' + file['name'], 'r') as f:
-            contents = f.read().encode('utf8')
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# (dev, ino) -> name, digest and stat fields of the last version hashed for that inode,
+# so a file that moved can be recognised and its digest reused without reading it again
+inodes = InodeIndex()
+mtime_fields = ('mtime_ns', 'mtime_us', 'mtime_ms', 'mtime')
+
+
+def inode_key(file):
+    if file.get('ino') is None:
+        return None
+    return (file.get('dev'), file['ino'])
+
 
-            print(hashlib.sha256(contents).hexdigest(), file)
+def unchanged(file, prior):
+    """Whether watchman's metadata shows `file` still has the content hashed as `prior`."""
+    sha1 = file.get('content.sha1hex')
+    if type(sha1) == str and type(prior.get('content.sha1hex')) == str:
+        return sha1 == prior['content.sha1hex']
+    mtime = next((k for k in mtime_fields if k in file), None)
+    return (mtime is not None and 'size' in file
+            and file['size'] == prior.get('size') and file[mtime] == prior.get(mtime))
 
-            with open(snapshot_path / hashlib.sha256(contents).hexdigest(), 'wb') as new_file:
-                new_file.write(contents)
 
-            return hashlib.sha256(contents).hexdigest()
+def remember(file, sha256):
+    key = inode_key(file)
+    if key is None:
+        return
+    mtime = next((k for k in mtime_fields if k in file), None)
+    sha1 = file.get('content.sha1hex')
+    inodes.put(key, file['name'], sha256, size=file.get('size'), mtime_field=mtime,
+               mtime=file[mtime] if mtime else None, sha1=sha1 if type(sha1) == str else None)
+
+
+def forget(names):
+    """Drop inode entries for deleted paths that were not claimed by a rename in the same update."""
+    for name in names:
+        inodes.forget(name)
+    inodes.commit()
+
+
+def update_file_handler(file):
+    if file.get('type') == 'd':
+        return None
+    prior = inodes.get(inode_key(file))
+    if prior is not None and unchanged(file, prior):
+        # same inode, same content: a rename/move or a metadata-only change
+        remember(file, prior['sha256'])
+        return prior['sha256']
+    try:
+        with open(path + '/' + file['name'], 'rb') as f:
+            raw = scheduler.read(f)
+        # decoded and re-encoded as text files always have been, newlines translated
+        contents = io.TextIOWrapper(io.BytesIO(raw), encoding='utf8').read().encode('utf8')
+        del raw
+
+        # the last version hashed at this inode or path lets the store rechunk only what changed
+        previous = prior or inodes.named(file['name'])
+        store = BlobStore.from_settings(snapshot_path, settings)
+        sha256 = store.put(contents, previous=previous['sha256'] if previous else None)
+        scheduler.wrote(store.written)
+        print(sha256, file)
+
+        remember(file, sha256)
+        return sha256
     except IsADirectoryError:
         pass
     except UnicodeDecodeError:
@@ -92,6 +235,7 @@ def update_file_handler(file):
 
 
 if __name__ == '__main__':
+    throttle.lower_priority(settings['niceness'], settings['ionice_class'])
     # run the watchman client update processing loop
     with pywatchman.client() as c:
         c.query("watch-project", path)
@@ -100,6 +244,11 @@ if __name__ == '__main__':
             try:
                 update = c.receive()
                 if update:
+                    scheduler.touch()
                     update_handler(update)
             except pywatchman.SocketTimeout:
                 pass
+            # hash large files whose tree has settled, or that have waited settle_max_seconds,
+            # under the root of the update that deferred them
+            for root, deferred in scheduler.due().items():
+                update_handler({'files': deferred, 'root': root, 'deferred': True})
@@ -14,6 +14,22 @@ def property_type(name, d, r):
         default_world.save()
         return klass
 
+def release_entity_cache():
+    """Drop owlready2's strong references to the most recently used entities.
+
+    owlready2 keeps the last 65536 entities it created or loaded alive; once
+    they are saved that only holds memory.
+    """
+    import owlready2.namespace
+    cache = owlready2.namespace._cache
+    cache[:] = [None] * len(cache)
+    owlready2.namespace._cache_index = 0
+
+def limit_store_memory(cache_mb):
+    """Cap SQLite's page cache for the quadstore (owlready2 allows 200MB) and stop it memory-mapping the file."""
+    default_world.graph.execute("PRAGMA cache_size = -%d" % (cache_mb * 1024))
+    default_world.graph.execute("PRAGMA mmap_size = 0")
+
 def sqlite_path(session_uuid):
     return str(Path.home() / ".watcher" / session_uuid) + ".sqlite3"
 